@@ -0,0 +1,168 @@
+import io
+import os
+import random
+import sys
+import time
+import types
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+# Run the benchmarks from the repository root, e.g.
+#
+#   python -m benchmarks.load [document.pdf]
+#
+# They use python-poppler-qt5 when it is installed. Otherwise a stand-in
+# that reads page sizes with PyPDF2 and renders blank images takes its
+# place, which is enough to count renders and to time everything else.
+
+_app = None
+_renders = 0
+
+
+def app():
+    global _app
+    if _app is None:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        _app = QtWidgets.QApplication([])
+    return _app
+
+
+def renders():
+    # Number of Page.renderToImage calls so far.
+    return _renders
+
+
+def _count(render):
+    def renderToImage(*args):
+        global _renders
+        _renders += 1
+        return render(*args)
+
+    return renderToImage
+
+
+class _StandInPage:
+    def __init__(self, size):
+        self._size = size
+
+    def pageSizeF(self):
+        return QtCore.QSizeF(*self._size)
+
+    def renderToImage(self, xres=72.0, yres=72.0, x=-1, y=-1, w=-1, h=-1):
+        if w < 0 or h < 0:
+            w = self._size[0] * xres / 72
+            h = self._size[1] * yres / 72
+        image = QtGui.QImage(max(1, int(w)), max(1, int(h)), QtGui.QImage.Format_RGB32)
+        image.fill(QtCore.Qt.white)
+        return image
+
+    def textList(self):
+        return []
+
+
+def _display_size(page):
+    # Like Poppler, the size of the crop box as the page is shown.
+    box = page.cropBox
+    size = (float(box.getWidth()), float(box.getHeight()))
+    if "/Rotate" in page and int(page["/Rotate"]) % 180:
+        size = size[::-1]
+    return size
+
+
+class _StandInDocument:
+    Antialiasing = 1
+    TextAntialiasing = 2
+
+    def __init__(self, data):
+        import PyPDF2
+
+        reader = PyPDF2.PdfFileReader(io.BytesIO(bytes(data)))
+        self._sizes = [_display_size(p) for p in reader.pages]
+
+    @staticmethod
+    def loadFromData(data):
+        return _StandInDocument(data)
+
+    def setRenderHint(self, hint, on=True):
+        pass
+
+    def setPaperColor(self, color):
+        pass
+
+    def numPages(self):
+        return len(self._sizes)
+
+    def page(self, number):
+        return _StandInPage(self._sizes[number])
+
+
+def use_poppler():
+    # Count the renders of the real Poppler, or install the stand-in.
+    # Must be called before pdfannotator is imported.
+    try:
+        import popplerqt5
+    except ImportError:
+        _StandInPage.renderToImage = _count(_StandInPage.renderToImage)
+        popplerqt5 = types.ModuleType("popplerqt5")
+        popplerqt5.Poppler = types.SimpleNamespace(Document=_StandInDocument)
+        sys.modules["popplerqt5"] = popplerqt5
+        return False
+    page = popplerqt5.Poppler.Page
+    page.renderToImage = _count(page.renderToImage)
+    return True
+
+
+def make_pdf(path, pages, draw=None):
+    # Write an A4 document; draw(painter, i) paints page i.
+    app()
+    writer = QtGui.QPdfWriter(path)
+    writer.setPageSize(QtGui.QPageSize(QtGui.QPageSize.A4))
+    writer.setResolution(72)
+    painter = QtGui.QPainter(writer)
+    try:
+        for i in range(pages):
+            if i:
+                writer.newPage()
+            if draw is None:
+                painter.drawText(72, 72, "Page %d" % (i + 1))
+            else:
+                draw(painter, i)
+    finally:
+        painter.end()
+
+
+def best_of(fn, repeat=5):
+    # The fastest of repeat runs of fn, in seconds.
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def text_page(seed=0, columns=2, lines=60, words=10):
+    # The words of a dense page, like a two-column paper, as lines of
+    # (left, top, right, bottom, text) in reading order.
+    rng = random.Random(seed)
+    column_width = (595 - 72 * 2 - 18 * (columns - 1)) / columns
+    page = []
+    for column in range(columns):
+        x0 = 72 + column * (column_width + 18)
+        for i in range(lines):
+            top = 72 + i * 11.5
+            x = x0
+            line = []
+            for j in range(words):
+                width = rng.uniform(8, column_width / words * 1.3)
+                if x + width > x0 + column_width:
+                    break
+                text = "".join(
+                    rng.choice("abcdefghijklmnopqrstuvwxyz")
+                    for k in range(max(1, int(width / 5)))
+                )
+                if rng.random() < 0.15:
+                    text += rng.choice(",.;:")
+                line.append((x, top, x + width, top + 9.5, text))
+                x += width + 3
+            page.append(line)
+    return page
@@ -0,0 +1,229 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import PyPDF2
+from PyPDF2.generic import RectangleObject
+from PyPDF2.pdf import ContentStream
+from PyQt5 import QtCore, QtGui
+from . import common
+
+# Exports a 500-page document with annotations on every page, in process
+# with PyPDF2 and, when pdftk is installed, the way export used to work:
+# print every page to a temporary PDF, write the original next to it, and
+# merge the two with pdftk multibackground.
+#
+# First it checks that annotations land where they were drawn on pages
+# that are rotated, or cropped to a box off the origin, as scans often
+# are.
+
+ROTATIONS = (0, 90, 180, 270)
+STRIKE = QtCore.QRectF(72, 100, 300, 10)
+PAINT = (b"S", b"s", b"f", b"F", b"f*", b"B", b"B*", b"b", b"b*")
+
+
+def pdftk_export(project, path):
+    from PyQt5 import QtPrintSupport
+
+    printer = QtPrintSupport.QPrinter()
+    printer.setColorMode(QtPrintSupport.QPrinter.Color)
+    printer.setOutputFormat(QtPrintSupport.QPrinter.PdfFormat)
+    printer.setOutputFileName(path + "~1")
+    printer.setPageMargins(0, 0, 0, 0, QtPrintSupport.QPrinter.Point)
+    page = project.document.page(0)
+    printer.setPaperSize(page.pageSizeF(), QtPrintSupport.QPrinter.Point)
+
+    painter = QtGui.QPainter()
+    if not painter.begin(printer):
+        return
+    first = True
+    for page in project.pages:
+        if first:
+            first = False
+        else:
+            printer.newPage()
+        page.pageItem.hide()
+        bg = page.scene.backgroundBrush()
+        page.scene.setBackgroundBrush(QtGui.QBrush(QtCore.Qt.NoBrush))
+        page.scene.render(painter, QtCore.QRectF(), page.pageItem.boundingRect())
+        page.scene.setBackgroundBrush(bg)
+        page.pageItem.show()
+    painter.end()
+    del painter
+    del printer
+    f = QtCore.QFile(path + "~2")
+    f.open(QtCore.QIODevice.WriteOnly)
+    f.write(project.pdfData)
+    f.close()
+    subprocess.call(
+        ["pdftk", path + "~1", "multibackground", path + "~2", "output", path]
+    )
+    os.remove(path + "~1")
+    os.remove(path + "~2")
+
+
+def placement_pdf(path, tmp):
+    # A page for each rotation, cropped to a box off the origin.
+    plain = os.path.join(tmp, "plain.pdf")
+    common.make_pdf(plain, len(ROTATIONS))
+    with open(plain, "rb") as fp:
+        reader = PyPDF2.PdfFileReader(fp)
+        writer = PyPDF2.PdfFileWriter()
+        for i, rotate in enumerate(ROTATIONS):
+            page = reader.getPage(i)
+            page.cropBox = RectangleObject([30, 40, 530, 800])
+            if rotate:
+                page.rotateClockwise(rotate)
+            writer.addPage(page)
+        with open(path, "wb") as out:
+            writer.write(out)
+
+
+def multiply(m, n):
+    # The matrix m followed by n, as [a b c d e f] like the cm operator.
+    return [
+        m[0] * n[0] + m[1] * n[2],
+        m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2],
+        m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4],
+        m[4] * n[1] + m[5] * n[3] + n[5],
+    ]
+
+
+def path_points(page, reader):
+    # The points of the paths painted on page, in its user space. Paths
+    # ended by n, like clipping paths, are left out.
+    ctm = [1, 0, 0, 1, 0, 0]
+    stack = []
+    path = []
+    points = []
+    for operands, operator in ContentStream(page.getContents(), reader).operations:
+        if operator == b"q":
+            stack.append(ctm)
+        elif operator == b"Q":
+            ctm = stack.pop()
+        elif operator == b"cm":
+            ctm = multiply([float(v) for v in operands], ctm)
+        elif operator in (b"m", b"l"):
+            x, y = map(float, operands)
+            path.append(
+                (
+                    ctm[0] * x + ctm[2] * y + ctm[4],
+                    ctm[1] * x + ctm[3] * y + ctm[5],
+                )
+            )
+        elif operator in PAINT:
+            points.extend(path)
+            path = []
+        elif operator == b"n":
+            path = []
+    return points
+
+
+def shown(page, x, y):
+    # Where a viewer shows the point (x, y) of page's user space, from the
+    # top left corner of the crop box turned by /Rotate.
+    box = page.cropBox
+    dx = x - float(box.getLowerLeft_x())
+    dy = y - float(box.getLowerLeft_y())
+    width = float(box.getWidth())
+    height = float(box.getHeight())
+    rotate = int(page["/Rotate"]) % 360 if "/Rotate" in page else 0
+    if rotate == 90:
+        return dy, dx
+    elif rotate == 180:
+        return width - dx, dy
+    elif rotate == 270:
+        return height - dy, width - dx
+    return dx, height - dy
+
+
+def check_placement(tmp):
+    # Strike through the same place on every page of placement_pdf and
+    # return the rotations whose strike is not shown there.
+    from pdfannotator import Project
+
+    path = os.path.join(tmp, "rotated.pdf")
+    placement_pdf(path, tmp)
+    project = Project()
+    project.create(path)
+    for page in project.pages:
+        page.insertStrikethrough(STRIKE)
+    output = os.path.join(tmp, "rotated_ann.pdf")
+    project.export(output)
+    middle = STRIKE.center().y()
+    expected = sorted([(STRIKE.left(), middle), (STRIKE.right(), middle)])
+    wrong = []
+    with open(output, "rb") as fp:
+        reader = PyPDF2.PdfFileReader(fp)
+        for i, rotate in enumerate(ROTATIONS):
+            page = reader.getPage(i)
+            points = sorted(shown(page, x, y) for x, y in path_points(page, reader))
+            if len(points) != 2 or any(
+                abs(p - q) > 0.5 for a, b in zip(points, expected) for p, q in zip(a, b)
+            ):
+                wrong.append(rotate)
+    return wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.export")
+    parser.add_argument("pdf", nargs="?", help="document to annotate")
+    parser.add_argument(
+        "--pages", type=int, default=500, help="pages of the generated document"
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="export processes")
+    args = parser.parse_args()
+
+    if not common.use_poppler() and args.jobs > 1:
+        # Worker processes import the real python-poppler-qt5.
+        print("--jobs needs python-poppler-qt5")
+        return 1
+    common.app()
+    from pdfannotator import Project
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.pdf
+        if path is None:
+            path = os.path.join(tmp, "document.pdf")
+            common.make_pdf(path, args.pages)
+        wrong = check_placement(tmp)
+        if wrong:
+            print("Misplaced annotations on pages rotated by", wrong)
+            return 1
+        print("Annotations placed right on rotated and cropped pages")
+
+        project = Project()
+        project.create(path)
+        for page in project.pages:
+            page.insertStrikethrough(QtCore.QRectF(72, 100, 300, 10))
+            page.insertText(QtCore.QPointF(480, 96)).setPlainText("sp.")
+        print("%d pages, all annotated" % (len(project.pages),))
+
+        output = os.path.join(tmp, "inprocess.pdf")
+        start = time.perf_counter()
+        project.export(output, args.jobs)
+        print(
+            "PyPDF2, %d job(s): %.2f s, %d bytes"
+            % (args.jobs, time.perf_counter() - start, os.path.getsize(output))
+        )
+
+        if shutil.which("pdftk") is None:
+            print("pdftk: not installed, skipped")
+            return 0
+        output = os.path.join(tmp, "pdftk.pdf")
+        start = time.perf_counter()
+        pdftk_export(project, output)
+        print(
+            "pdftk: %.2f s, %d bytes"
+            % (time.perf_counter() - start, os.path.getsize(output))
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
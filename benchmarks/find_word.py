@@ -0,0 +1,89 @@
+import sys
+import random
+import argparse
+from PyQt5 import QtCore
+from . import common
+
+# Compares PdfPageItem.find_word, which bisects the lines and words of a
+# PageText, with the linear scan over every line and word it replaced.
+
+
+def page_text(page):
+    # Lay out the words of common.text_page the way partition_into_lines
+    # does: lines sorted by their top edge, with the space between two
+    # words as a word without text.
+    from pdfannotator.widgets.pdfpageitem import PageText
+
+    boxes = []
+    texts = []
+    text_offsets = [0]
+    line_starts = [0]
+    for line in sorted(page, key=lambda line: line[0][1]):
+        last_end = None
+        for left, top, right, bottom, text in line:
+            if last_end is not None:
+                boxes.append((last_end, top, left, bottom))
+                texts.append("")
+                text_offsets.append(text_offsets[-1])
+            boxes.append((left, top, right, bottom))
+            texts.append(text)
+            text_offsets.append(text_offsets[-1] + len(text))
+            last_end = right
+        line_starts.append(len(boxes))
+    return PageText(boxes, "".join(texts), text_offsets, line_starts)
+
+
+def scan(lines, pos):
+    # find_word before the index: lines is a list of (bbox, words).
+    for i, (bbox, line) in enumerate(lines):
+        if not bbox.contains(pos):
+            continue
+        for j, word in enumerate(line):
+            if word.bbox.contains(pos):
+                return i, j
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.find_word")
+    parser.add_argument("--lines", type=int, default=60, help="lines per column")
+    parser.add_argument("--columns", type=int, default=2)
+    parser.add_argument("--points", type=int, default=2000, help="hit-tests to time")
+    args = parser.parse_args()
+
+    common.use_poppler()
+    text = page_text(common.text_page(0, args.columns, args.lines, words=12))
+    lines = [
+        (text.line_bbox(i), [text.word(i, j) for j in range(text.line_length(i))])
+        for i in range(len(text))
+    ]
+    rng = random.Random(1)
+    points = [
+        QtCore.QPointF(rng.uniform(60, 540), rng.uniform(60, 72 + 11.5 * args.lines))
+        for i in range(args.points)
+    ]
+
+    expected = [scan(lines, pos) for pos in points]
+    found = [text.find(pos) for pos in points]
+    if found != expected:
+        print(
+            "Index and scan disagree on %d points"
+            % (sum(a != b for a, b in zip(found, expected)),)
+        )
+        return 1
+
+    words = len(text.word_boxes)
+    hits = sum(result is not None for result in found)
+    print(
+        "%d lines, %d words; %d of %d points hit a word"
+        % (len(text), words, hits, len(points))
+    )
+    old = common.best_of(lambda: [scan(lines, pos) for pos in points])
+    new = common.best_of(lambda: [text.find(pos) for pos in points])
+    per = 1e6 / len(points)
+    print("Linear scan: %.1f us per hit-test" % (old * per,))
+    print("Index:       %.1f us per hit-test (%.1fx)" % (new * per, old / new))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+from PyQt5 import QtCore, QtGui, QtTest, QtWidgets
+from . import common
+
+# Replays synthetic mouse input on a rect annotation through a
+# QGraphicsView: a resize drag whose moves all arrive within one frame, one
+# whose moves arrive every few ms like a fast mouse, and hover moves inside
+# one edge zone. Before, every move event changed the item's geometry and
+# every hover move set the cursor; now the geometry changes at most once
+# per frame and the cursor only when the zone changes.
+
+
+class Counter:
+    # Counts the calls of an item's method.
+    def __init__(self, item, name):
+        self.calls = 0
+        method = getattr(item, name)
+
+        def counted(*args):
+            self.calls += 1
+            return method(*args)
+
+        setattr(item, name, counted)
+
+
+def move(view, pos, buttons):
+    # The scene finds the items to hover by the screen position, so that
+    # must be given too.
+    local = view.mapFromScene(pos)
+    event = QtGui.QMouseEvent(
+        QtCore.QEvent.MouseMove,
+        QtCore.QPointF(local),
+        QtCore.QPointF(view.viewport().mapTo(view.window(), local)),
+        QtCore.QPointF(view.viewport().mapToGlobal(local)),
+        QtCore.Qt.NoButton,
+        buttons,
+        QtCore.Qt.NoModifier,
+    )
+    QtCore.QCoreApplication.sendEvent(view.viewport(), event)
+
+
+def drag(view, item, moves, interval, frame):
+    # Resize item by its bottom-right corner, and wait two frames of frame
+    # ms before the release. Returns the seconds spent handling the move
+    # events and the geometry changes they caused; the release, which
+    # pushes the undo command, is not counted.
+    changes = Counter(item, "prepareGeometryChange")
+    corner = item.innerRect.bottomRight() - QtCore.QPointF(1, 1)
+    QtTest.QTest.mousePress(
+        view.viewport(),
+        QtCore.Qt.LeftButton,
+        QtCore.Qt.NoModifier,
+        view.mapFromScene(corner),
+    )
+    seconds = 0
+    for i in range(1, moves + 1):
+        pos = corner + QtCore.QPointF(i / 4, i / 8)
+        start = time.perf_counter()
+        move(view, pos, QtCore.Qt.LeftButton)
+        seconds += time.perf_counter() - start
+        if interval:
+            QtTest.QTest.qWait(interval)
+    QtTest.QTest.qWait(2 * frame)
+    calls = changes.calls
+    QtTest.QTest.mouseRelease(
+        view.viewport(),
+        QtCore.Qt.LeftButton,
+        QtCore.Qt.NoModifier,
+        view.mapFromScene(pos),
+    )
+    return seconds, calls
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.input")
+    parser.add_argument("--moves", type=int, default=200, help="move events per drag")
+    parser.add_argument(
+        "--interval", type=int, default=4, help="ms between the moves of a fast mouse"
+    )
+    args = parser.parse_args()
+
+    common.use_poppler()
+    common.app()
+    from pdfannotator import Project
+    from pdfannotator.widgets.item import RectItem, FRAME_INTERVAL
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "document.pdf")
+        common.make_pdf(path, 1)
+        project = Project()
+        project.create(path)
+        page = project.pages[0]
+        item = RectItem(page)
+        item.innerRect = QtCore.QRectF(100, 100, 100, 100)
+        page.insertItems([item])
+        view = QtWidgets.QGraphicsView(page.scene)
+        view.resize(700, 900)
+        view.show()
+        QtTest.QTest.qWait(FRAME_INTERVAL)
+
+        seconds, changes = drag(view, item, args.moves, 0, FRAME_INTERVAL)
+        print(
+            "%d moves in one frame: %.1f µs per move, %d geometry changes"
+            % (args.moves, seconds / args.moves * 1e6, changes)
+        )
+        burst = changes
+
+        start = time.perf_counter()
+        seconds, changes = drag(view, item, args.moves, args.interval, FRAME_INTERVAL)
+        print(
+            "%d moves %d ms apart: %.1f µs per move, %d geometry changes in %.2f s"
+            % (
+                args.moves,
+                args.interval,
+                seconds / args.moves * 1e6,
+                changes,
+                time.perf_counter() - start,
+            )
+        )
+
+        # Hover along the inside of the right edge, all in one zone.
+        cursors = Counter(item, "setCursor")
+        rect = item.innerRect
+        x = rect.right() - 1
+        y = rect.top() + 10
+        hovers = 0
+        start = time.perf_counter()
+        while y < rect.bottom() - 10:
+            move(view, QtCore.QPointF(x, y), QtCore.Qt.NoButton)
+            y += 1
+            hovers += 1
+        print(
+            "%d hover moves in one zone: %.1f µs per move, %d setCursor calls"
+            % (hovers, (time.perf_counter() - start) / hovers * 1e6, cursors.calls)
+        )
+        del project
+    return 1 if burst > 1 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+import sys
+import time
+import argparse
+import collections
+from PyQt5 import QtCore
+from . import common
+
+# Times the layout analysis of a 500-page text-heavy document: splitting
+# the words of each page into lines, and finding the margins that V and -
+# put their text in. The Python implementation this replaced is kept
+# below for comparison.
+#
+# Given a document, its text comes from python-poppler-qt5; otherwise the
+# pages are synthetic two-column pages.
+
+
+class TextBox:
+    # The parts of Poppler.TextBox that partition_into_lines uses.
+    def __init__(self, left, top, right, bottom, text):
+        self._bbox = QtCore.QRectF(left, top, right - left, bottom - top)
+        self._text = text
+        self._next = None
+
+    def boundingBox(self):
+        return self._bbox
+
+    def text(self):
+        return self._text
+
+    def nextWord(self):
+        return self._next
+
+    def charBoundingBox(self, i):
+        width = self._bbox.width() / len(self._text)
+        return QtCore.QRectF(
+            self._bbox.left() + i * width, self._bbox.top(), width, self._bbox.height()
+        )
+
+
+def text_list(page):
+    boxes = []
+    for line in page:
+        words = [TextBox(*word) for word in line]
+        for word, next_word in zip(words, words[1:]):
+            word._next = next_word
+        boxes.extend(words)
+    return boxes
+
+
+Line = collections.namedtuple("Line", "bbox words")
+Word = collections.namedtuple("Word", "bbox text")
+
+
+def smallest_enclosing_rectf(bboxes):
+    top = bboxes[0].top()
+    left = bboxes[0].left()
+    right = bboxes[0].right()
+    bottom = bboxes[0].bottom()
+    for bbox in bboxes:
+        top = min(top, bbox.top())
+        left = min(left, bbox.left())
+        right = max(right, bbox.right())
+        bottom = max(bottom, bbox.bottom())
+    return QtCore.QRectF(left, top, right - left, bottom - top)
+
+
+def old_partition_into_lines(textbox):
+    from pdfannotator.widgets.pdfpageitem import split_word
+
+    in_degree = {word: 0 for word in textbox}
+    for word in textbox:
+        if word.nextWord():
+            in_degree[word.nextWord()] += 1
+    lines = []
+    for word in textbox:
+        if in_degree[word] == 1:
+            continue
+        line = []
+        bboxes = []
+        last_end = None
+        while len(line) < len(textbox):
+            bbox = word.boundingBox()
+            if last_end is not None:
+                space_bbox = QtCore.QRectF(
+                    last_end, bbox.top(), bbox.left() - last_end, bbox.height()
+                )
+                line.append(Word(space_bbox, ""))
+            last_end = bbox.right()
+            text = word.text()
+            bounds = split_word(text)
+            if len(bounds) == 1:
+                line.append(Word(bbox, text))
+                bboxes.append(bbox)
+            else:
+                char_bbox = [word.charBoundingBox(i) for i in range(len(text))]
+                for i, j in bounds:
+                    sub_bbox = smallest_enclosing_rectf(char_bbox[i:j])
+                    line.append(Word(sub_bbox, text[i:j]))
+                    bboxes.append(sub_bbox)
+            word = word.nextWord()
+            if not word or in_degree[word] != 1:
+                break
+        bbox = smallest_enclosing_rectf(bboxes)
+        lines.append(Line(bbox, line))
+    lines.sort(key=lambda line: line[0].top())
+    return lines
+
+
+def old_margin_point(lines, right_margin, top):
+    widths = [line.bbox.width() for line in lines]
+    median_width = sorted(widths)[len(widths) // 2]
+    lines = [line for line in lines if line.bbox.width() >= median_width]
+    lefts = []
+    rights = []
+    for line in lines:
+        lefts.append(line.bbox.left())
+        rights.append(right_margin - line.bbox.right())
+    left = sorted(lefts)[int(len(lefts) * 0.2)]
+    right = sorted(rights)[int(len(rights) * 0.2)]
+    if left > right:
+        return QtCore.QPointF(8, top)
+    else:
+        return QtCore.QPointF(right_margin - right + 8, top)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.layout")
+    parser.add_argument("pdf", nargs="?", help="document to analyse")
+    parser.add_argument("--pages", type=int, default=500, help="synthetic pages")
+    parser.add_argument("--keys", type=int, default=10, help="V or - presses per page")
+    args = parser.parse_args()
+
+    real = common.use_poppler()
+    from pdfannotator.widgets.pdfpageitem import partition_into_lines, margin_offsets
+
+    if args.pdf:
+        if not real:
+            print("Reading the text of a document needs python-poppler-qt5")
+            return 1
+        from pdfannotator.renderer import load_document
+
+        f = QtCore.QFile(args.pdf)
+        f.open(QtCore.QIODevice.ReadOnly)
+        document = load_document(f.readAll())
+        pages = [document.page(i).textList() for i in range(document.numPages())]
+        width = document.page(0).pageSizeF().width()
+    else:
+        pages = [text_list(common.text_page(i)) for i in range(args.pages)]
+        width = 595
+    words = sum(len(page) for page in pages)
+    print("%d pages, %d words" % (len(pages), words))
+
+    start = time.perf_counter()
+    old = [old_partition_into_lines(page) for page in pages]
+    old_lines = time.perf_counter() - start
+    start = time.perf_counter()
+    new = [partition_into_lines(page) for page in pages]
+    new_lines = time.perf_counter() - start
+    print("Lines:   %.2f s before, %.2f s now" % (old_lines, new_lines))
+
+    # Before, every key press sorted the lines of the page again; now the
+    # margins are computed on the first press and kept.
+    start = time.perf_counter()
+    for lines in old:
+        for i in range(args.keys):
+            old_margin_point(lines, width, 100)
+    old_margins = time.perf_counter() - start
+    start = time.perf_counter()
+    for text in new:
+        margin_offsets(text.line_boxes, width)
+    new_margins = time.perf_counter() - start
+    print(
+        "Margins: %.3f s before, %.3f s now (%d presses per page)"
+        % (old_margins, new_margins, args.keys)
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
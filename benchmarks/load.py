@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+from . import common
+
+# Opening a document or a project must not render any page; page sizes
+# come from pageSizeF. The time a 72 dpi render of every page takes,
+# which is what opening used to cost, is shown for comparison.
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.load")
+    parser.add_argument("pdf", nargs="?", help="document to open")
+    parser.add_argument(
+        "--pages", type=int, default=500, help="pages of the generated document"
+    )
+    args = parser.parse_args()
+
+    real = common.use_poppler()
+    common.app()
+    from pdfannotator import Project
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.pdf
+        if path is None:
+            path = os.path.join(tmp, "document.pdf")
+            common.make_pdf(path, args.pages)
+        print("Poppler:", "python-poppler-qt5" if real else "stand-in")
+
+        project = Project()
+        before = common.renders()
+        start = time.perf_counter()
+        project.create(path)
+        seconds = time.perf_counter() - start
+        count = len(project.pages)
+        created = common.renders() - before
+        print("Open %d-page document: %.3f s, %d renders" % (count, seconds, created))
+
+        # Building a scene sizes its page item; tiles are rendered on paint.
+        before = common.renders()
+        start = time.perf_counter()
+        project.pages[0].scene
+        seconds = time.perf_counter() - start
+        shown = common.renders() - before
+        print("Build the first page's scene: %.3f s, %d renders" % (seconds, shown))
+        created += shown
+
+        project.path = os.path.join(tmp, "project.pep")
+        project.save()
+        project = Project()
+        before = common.renders()
+        start = time.perf_counter()
+        project.load(os.path.join(tmp, "project.pep"))
+        seconds = time.perf_counter() - start
+        loaded = common.renders() - before
+        print("Open project: %.3f s, %d renders" % (seconds, loaded))
+
+        start = time.perf_counter()
+        for page in range(count):
+            project.document.page(page).renderToImage(72, 72)
+        print(
+            "For comparison, a 72 dpi render of every page: %.3f s"
+            % (time.perf_counter() - start,)
+        )
+    return 1 if created or loaded else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,41 @@
-import popplerqt5
-from PyQt5 import QtGui, QtCore, QtWidgets, uic, QtPrintSupport
+from PyQt5 import QtGui, QtCore, QtWidgets, uic
 import os
-import subprocess
+import bisect
+import hashlib
+import collections
 from .widgets.textitem import TextItem
-from .widgets.pdfpageitem import PdfPageItem
+from .widgets.pdfpageitem import PdfPageItem, partition_into_lines
 from .widgets.item import ItemBase, ImageItem, RectItem
 from .widgets.strikethrough import StrikethroughItem
+from .widgets.latexitem import LatexItem
+from .rendercache import RenderCache
+from .renderer import RenderService, Prefetcher, load_document
+from .textlayout import TextLayoutService
+from . import pepfile
+from .autosave import Autosaver
+from .latex import LatexService
+from .annotations import AnnotationStore, bulk_scene
+from .commands import (
+    AddItemsCommand,
+    RemoveItemsCommand,
+    MoveItemsCommand,
+    FontCommand,
+    UNDO_LIMIT,
+)
+from .export import render_overlay, render_parallel, merge_overlay
 
 
 class ObjectTreeModel(QtCore.QAbstractItemModel):
+    # Pages are the top-level rows, and the objects of a page are its
+    # children. A page's row is its number; the row of an object comes
+    # from the page's AnnotationStore. Changes to Page.objects go through
+    # addObjects and removeObjects so that views are told exactly which
+    # rows changed.
+
+    # A change that splits into more runs of rows than this is reported
+    # as one layout change instead of one insertion or removal per run.
+    max_runs = 16
+
     def __init__(self, project):
         QtCore.QAbstractItemModel.__init__(self)
         self.project = project
@@ -17,15 +44,12 @@ class ObjectTreeModel(QtCore.QAbstractItemModel):
         return 1
 
     def rowCount(self, parent):
-        p = self.project
-        if parent.isValid():
-            p = parent.internalPointer()
-        if isinstance(p, Project):
-            return len(p.pages)
-        elif isinstance(p, Page):
+        if not parent.isValid():
+            return len(self.project.pages)
+        p = parent.internalPointer()
+        if isinstance(p, Page):
             return len(p.objects)
-        else:
-            return 0
+        return 0
 
     def data(self, index, role):
         if not index.isValid():
@@ -35,50 +59,245 @@ class ObjectTreeModel(QtCore.QAbstractItemModel):
         i = index.internalPointer()
         if isinstance(i, Page):
             return "Page %i" % (i.number + 1)
-        elif isinstance(i, ItemBase):
-            return i.getName()
-        return None
+        return i.getName()
 
     def parent(self, index):
         if not index.isValid():
-            return None
+            return QtCore.QModelIndex()
         p = index.internalPointer()
         if isinstance(p, Page):
-            return self.createIndex(0, 0, p.project)
-        elif isinstance(p, ItemBase):
-            return self.createIndex(0, 0, p.page)
-        return QtCore.QModelIndex()
+            return QtCore.QModelIndex()
+        return self.pageIndex(p.page)
 
     def index(self, row, column, parent):
-        p = self.project
-        if parent.isValid():
-            p = parent.internalPointer()
-        if row < 0:
-            return None
-        if isinstance(p, Project):
-            if row >= len(p.pages):
-                return None
-            return self.createIndex(row, column, p.pages[row])
-        elif isinstance(p, Page):
-            if row >= len(p.objects):
-                return None
+        if row < 0 or column != 0:
+            return QtCore.QModelIndex()
+        if not parent.isValid():
+            if row >= len(self.project.pages):
+                return QtCore.QModelIndex()
+            return self.createIndex(row, column, self.project.pages[row])
+        p = parent.internalPointer()
+        if isinstance(p, Page) and row < len(p.objects):
             return self.createIndex(row, column, p.objects[row])
+        return QtCore.QModelIndex()
+
+    def pageIndex(self, page):
+        return self.createIndex(page.number, 0, page)
+
+    def objectIndex(self, item):
+        return self.createIndex(item.page.objects.row(item), 0, item)
+
+    def addObjects(self, page, items, rows=None):
+        # Append items to the page's store, or insert them so that they end
+        # up at the given ascending rows. Returns their IDs in the store.
+        if not items:
+            return []
+        parent = self.pageIndex(page)
+        if rows is None:
+            first = len(page.objects)
+            self.beginInsertRows(parent, first, first + len(items) - 1)
+            ids = page.objects.add_many(items)
+            self.endInsertRows()
+            return ids
+        runs = _runs(rows)
+        if len(runs) <= self.max_runs:
+            # The earlier runs are in place when a run is inserted,
+            # so its rows are already the final ones.
+            ids = []
+            start = 0
+            for first, last in runs:
+                end = start + last - first + 1
+                self.beginInsertRows(parent, first, last)
+                ids += page.objects.insert_many(rows[start:end], items[start:end])
+                self.endInsertRows()
+                start = end
+            return ids
+        self.layoutAboutToBeChanged.emit([QtCore.QPersistentModelIndex(parent)])
+        old = self._objectPersistentIndexes(page)
+        ids = page.objects.insert_many(rows, items)
+        new = [
+            self.createIndex(
+                page.objects.row(index.internalPointer()), 0, index.internalPointer()
+            )
+            for index in old
+        ]
+        self.changePersistentIndexList(old, new)
+        self.layoutChanged.emit([QtCore.QPersistentModelIndex(parent)])
+        return ids
+
+    def removeObjects(self, page, items):
+        rows = sorted(page.objects.row(item) for item in items)
+        runs = _runs(rows)
+        parent = self.pageIndex(page)
+        if len(runs) <= self.max_runs:
+            # Remove each run of consecutive rows with one notification,
+            # starting from the end so that the earlier rows stay put.
+            for first, last in reversed(runs):
+                self.beginRemoveRows(parent, first, last)
+                page.objects.remove_rows(first, last)
+                self.endRemoveRows()
+            return
+        # Scattered rows: move the persistent indexes of the page's objects
+        # to their new rows, or invalidate them, in one layout change.
+        self.layoutAboutToBeChanged.emit([QtCore.QPersistentModelIndex(parent)])
+        removed = set(rows)
+        old = self._objectPersistentIndexes(page)
+        new = [
+            QtCore.QModelIndex()
+            if index.row() in removed
+            else self.createIndex(
+                index.row() - bisect.bisect_left(rows, index.row()),
+                0,
+                index.internalPointer(),
+            )
+            for index in old
+        ]
+        page.objects.remove_many(items)
+        self.changePersistentIndexList(old, new)
+        self.layoutChanged.emit([QtCore.QPersistentModelIndex(parent)])
+
+    def _objectPersistentIndexes(self, page):
+        return [
+            index
+            for index in self.persistentIndexList()
+            if not isinstance(index.internalPointer(), Page)
+            and index.internalPointer().page is page
+        ]
+
+    def resetPages(self, pages):
+        self.beginResetModel()
+        self.project.pages = pages
+        self.endResetModel()
+
+
+def _runs(rows):
+    # Split ascending rows into runs of consecutive rows, as [first, last].
+    runs = []
+    for row in rows:
+        if runs and runs[-1][1] == row - 1:
+            runs[-1][1] = row
         else:
-            return None
+            runs.append([row, row])
+    return runs
+
+
+ITEM_TYPES = [ImageItem, RectItem, TextItem, StrikethroughItem, LatexItem]
+
+
+def read_items(page, stream, version):
+    # Create the annotation items stored in a page section for page.
+    items = []
+    count = stream.readUInt32()
+    for i in range(count):
+        d = stream.readUInt32()
+        for t in ITEM_TYPES:
+            if t.id() != d:
+                continue
+            item = t(page)
+            item.load(stream, version)
+            items.append(item)
+    return items
+
+
+SaveSnapshot = collections.namedtuple(
+    "SaveSnapshot", "path append file pdfData sections digests index"
+)
 
 
 class Page(QtCore.QObject):
+    # The scene and the PdfPageItem are built on first use, so that opening
+    # a document only costs a placeholder per page.
+    _scene = None
+    _pageItem = None
+    _pendingSection = None
+    myFont = None
+
     def __init__(self, project, i):
         QtCore.QObject.__init__(self)
         self.number = i
-        self.objects = []
+        self.objects = AnnotationStore()
+        self.project = project
 
-        self.scene = QtWidgets.QGraphicsScene()
-        self.scene.setBackgroundBrush(QtCore.Qt.gray)
-        self.pageItem = PdfPageItem(project.document.page(i), self)
-        self.scene.addItem(self.pageItem)
+    def isLoaded(self):
+        return self._scene is not None
 
-        self.project = project
+    def _load_scene(self):
+        self._scene = QtWidgets.QGraphicsScene()
+        self._scene.setBackgroundBrush(QtCore.Qt.gray)
+        self._scene.installEventFilter(self)
+        self._dragStart = None
+        self._pageItem = PdfPageItem(
+            self.project.document.page(self.number), self, self.project.renderer
+        )
+        self._scene.addItem(self._pageItem)
+        if self._pendingSection is not None:
+            pep, version = self._pendingSection
+            self._pendingSection = None
+            self.load(QtCore.QDataStream(pep.readSection(self.number)), version)
+            self.project.sectionLoaded(self)
+
+    def setPendingSection(self, pep, version):
+        # Deserialize the annotations of this page from pep when it is
+        # first shown, instead of now.
+        self._pendingSection = (pep, version)
+
+    def eventFilter(self, obj, event):
+        # Items are dragged by the scene itself; record where the selected
+        # items were when a drag starts, and push the moves when it ends.
+        t = event.type()
+        if t == QtCore.QEvent.GraphicsSceneMousePress:
+            self._dragStart = None
+        elif t == QtCore.QEvent.GraphicsSceneMouseMove:
+            if event.buttons() and self._dragStart is None:
+                self._dragStart = {
+                    item: item.pos()
+                    for item in self._scene.selectedItems()
+                    if item in self.objects
+                }
+        elif t == QtCore.QEvent.GraphicsSceneMouseRelease and self._dragStart:
+            moves = {
+                item: (pos, item.pos())
+                for item, pos in self._dragStart.items()
+                if item.pos() != pos
+            }
+            self._dragStart = None
+            if moves:
+                self.project.undoStack.push(MoveItemsCommand(moves))
+        return False
+
+    def hasPendingSection(self):
+        return self._pendingSection is not None
+
+    def hasAnnotations(self):
+        # Pages are only given a pending section if they have annotations.
+        return self.hasPendingSection() or bool(self.objects)
+
+    @property
+    def scene(self):
+        if self._scene is None:
+            self._load_scene()
+        return self._scene
+
+    @property
+    def pageItem(self):
+        if self._scene is None:
+            self._load_scene()
+        return self._pageItem
+
+    def release(self):
+        # Drop the scene of a page that has gone out of view. Pages with
+        # annotations keep theirs, since the annotation items live in it.
+        if self._scene is None or self.objects:
+            return
+        self.project.renderer.cancel(lambda key: key[0] == self.number)
+        self._scene = None
+        self._pageItem = None
+
+    def text_layout(self):
+        if self.project.textLayout is None:
+            page = self.project.document.page(self.number)
+            return partition_into_lines(page.textList())
+        return self.project.textLayout.lines(self.number, self.project.document)
 
     def text_selection_changed(self, nonempty):
         if nonempty:
@@ -94,17 +313,18 @@ class Page(QtCore.QObject):
 
     def insertStrikethrough(self, line_bbox):
         item = StrikethroughItem(self, line_bbox)
-        self.scene.addItem(item)
-        self.objects.append(item)
+        self.insertItems([item], "Strike through")
         return item
 
-    def addTextUnderCursor(self, application):
-        pos = application.pageView.mapToScene(
-            application.pageView.mapFromGlobal(QtGui.QCursor.pos())
-        )
-        anchor = "baseline"
+    def addTextAt(self, pos):
         self._addText(pos, "baseline", focus=True)
 
+    def addLatexAt(self, pos, source):
+        item = LatexItem(self, source)
+        item.changeRect(QtCore.QRectF(pos, item.innerRect.size()))
+        self.insertItems([item], "Add LaTeX")
+        return item
+
     def _addText(self, pos, anchor, focus):
         text = TextItem(self, self.myFont)
         if anchor == "baseline":
@@ -117,8 +337,7 @@ class Page(QtCore.QObject):
         else:
             raise ValueError(anchor)
         text.setPos(topleft)
-        self.scene.addItem(text)
-        self.objects.append(text)
+        self.insertItems([text], "Add text")
         if focus:
             text.setSelected(True)
             text.setTextInteractionFlags(QtCore.Qt.TextEditorInteraction)
@@ -135,50 +354,127 @@ class Page(QtCore.QObject):
             obj.save(stream, version)
 
     def load(self, stream, version):
-        count = stream.readUInt32()
-        for i in range(count):
-            d = stream.readUInt32()
-            for t in [ImageItem, RectItem, TextItem, StrikethroughItem]:
-                if t.id() != d:
-                    continue
-                item = t(self)
-                item.load(stream, version)
-                self.scene.addItem(item)
-                self.objects.append(item)
+        self.add_many(read_items(self, stream, version))
+
+    def add_many(self, items, rows=None):
+        # Add annotation items to the scene, the store and the tree,
+        # and return their IDs. The items are appended, or put at the
+        # given ascending rows, as when a removal is undone.
+        if not items:
+            return []
+        scene = self.scene
+        if rows is None:
+            with bulk_scene(scene, len(items)):
+                for item in items:
+                    scene.addItem(item)
+            return self.project.treeModel.addObjects(self, items)
+        ids = self.project.treeModel.addObjects(self, items, rows)
+        # Items are stacked in the order they were added to the scene, so
+        # everything from the first row on is added again, in order, which
+        # puts the items back where they were. All removals go first: the
+        # scene renumbers its items on an addition after a removal.
+        after = self.objects[rows[0] :]
+        with bulk_scene(scene, len(after)):
+            for item in after:
+                if item.scene() is scene:
+                    scene.removeItem(item)
+            for item in after:
+                scene.addItem(item)
+        return ids
+
+    def insertItems(self, items, text="Add annotations"):
+        # add_many as one step on the undo stack.
+        self.project.undoStack.push(AddItemsCommand(self, items, text))
+
+    def remove_many(self, items):
+        items = [item for item in items if item in self.objects]
+        if not items:
+            return
+        scene = self.scene
+        with bulk_scene(scene, len(items)):
+            for item in items:
+                scene.removeItem(item)
+        self.project.treeModel.removeObjects(self, items)
+
+    def removeIds(self, ids, text="Delete annotations"):
+        # Remove the annotations with the given IDs, as returned by
+        # add_many, as one step on the undo stack.
+        items = [self.objects.get(id) for id in ids]
+        items = [item for item in items if item is not None]
+        if items:
+            self.project.undoStack.push(RemoveItemsCommand(self, items, text))
+
+    def sectionData(self):
+        # The serialized annotations of this page and their version, read
+        # from the project file if the page has not been loaded.
+        if self._pendingSection is not None:
+            pep, version = self._pendingSection
+            return bytes(pep.readSection(self.number)), version
+        return self.project.pageSection(self), pepfile.VERSION
 
     def deleteSelection(self):
-        for item in self.scene.selectedItems():
-            self.scene.removeItem(item)
-            self.objects.remove(item)
+        if not self.isLoaded():
+            return
+        items = [item for item in self.scene.selectedItems() if item in self.objects]
+        if items:
+            self.project.undoStack.push(RemoveItemsCommand(self, items))
 
     def itemSelected(self, item):
         self.parent.itemSelected.emit(item)
 
     def changeFont(self, font):
         self.myFont = font
-        for item in self.scene.selectedItems():
-            if isinstance(item, TextItem):
-                item.setFont(font)
+        if not self.isLoaded():
+            return
+        items = [
+            item
+            for item in self.scene.selectedItems()
+            if isinstance(item, TextItem) and item.font() != font
+        ]
+        if items:
+            self.project.undoStack.push(FontCommand(items, font))
 
 
 class Project(QtCore.QObject):
     itemSelected = QtCore.pyqtSignal([QtWidgets.QGraphicsItem])
+    # Set by the main window; projects loaded without one use Qt's default.
+    font = None
 
-    def __init__(self):
+    def __init__(self, textLayout=True):
+        # Without textLayout, as for headless commands, the text layout of
+        # the pages is not extracted in the background, only on request.
         super().__init__()
         self.undoStack = QtWidgets.QUndoStack()
+        self.undoStack.setUndoLimit(UNDO_LIMIT)
         self.document = None
         self.pages = []
         self.treeModel = ObjectTreeModel(self)
+        self.renderCache = RenderCache()
+        self.renderer = RenderService(self.renderCache)
+        self.prefetcher = Prefetcher(self)
+        self.textLayout = TextLayoutService() if textLayout else None
+        self.latex = LatexService()
         self.path = None
+        # The file last saved or loaded, and a digest of each page section
+        # in it, so that save() can append just the pages that changed.
+        self.file = None
+        self._sectionDigests = {}
+        # The PepFile whose memory map backs pdfData, if any.
+        self._pdfSource = None
+        self.autosaver = Autosaver(self)
 
     def load_pdf(self, pdfData):
+        self.autosaver.wait()
         self.undoStack.clear()
         self.pdfData = pdfData
-        self.document = popplerqt5.Poppler.Document.loadFromData(pdfData)
-        self.document.setRenderHint(popplerqt5.Poppler.Document.Antialiasing, True)
-        self.document.setRenderHint(popplerqt5.Poppler.Document.TextAntialiasing, True)
-        self.pages = [Page(self, i) for i in range(self.document.numPages())]
+        self.document = load_document(pdfData)
+        self.renderer.setDocument(pdfData)
+        self.prefetcher.reset()
+        if self.textLayout is not None:
+            self.textLayout.setDocument(pdfData, self.document.numPages())
+        self.treeModel.resetPages(
+            [Page(self, i) for i in range(self.document.numPages())]
+        )
 
     def create(self, path):
         if not os.path.exists(path):
@@ -187,20 +483,96 @@ class Project(QtCore.QObject):
         pdf.open(QtCore.QIODevice.ReadOnly)
         pdfData = pdf.readAll()
         self.load_pdf(pdfData)
+        self._pdfSource = None
         self.path = os.path.splitext(str(path))[0] + ".pep"
+        self.file = None
+        self._sectionDigests = {}
+
+    def pageSection(self, page):
+        data = QtCore.QByteArray()
+        stream = QtCore.QDataStream(data, QtCore.QIODevice.WriteOnly)
+        page.save(stream, pepfile.VERSION)
+        return bytes(data)
+
+    def snapshot(self):
+        # Capture on the GUI thread what a save has to write: the sections
+        # of the pages that changed, or of all pages if the file has to be
+        # written from scratch. Sections not yet read from the current file
+        # are None, and are copied by writeSnapshot.
+        append = (
+            self.file is not None
+            and self.file.canAppend(self.path)
+            and not self.file.needsCompaction()
+        )
+        sections = {}
+        digests = {}
+        for page in self.pages:
+            if page.hasPendingSection():
+                if not append:
+                    sections[page.number] = None
+                continue
+            digest = self._sectionDigests.get(page.number)
+            if append and not page.isLoaded() and digest is None:
+                # Had no annotations and has not been shown since.
+                continue
+            section = self.pageSection(page)
+            digests[page.number] = self._sectionDigest(page, section)
+            if not append or digests[page.number] != digest:
+                sections[page.number] = section
+        return SaveSnapshot(
+            self.path,
+            append,
+            self.file,
+            self.pdfData,
+            sections,
+            digests,
+            self.undoStack.index(),
+        )
+
+    def writeSnapshot(self, snapshot):
+        # Write a snapshot to disk and return the resulting PepFile.
+        # This does not touch any pages, so it may run on a worker thread.
+        if snapshot.append:
+            if snapshot.sections:
+                snapshot.file.append(snapshot.sections)
+            return snapshot.file
+        sections = [
+            snapshot.file.readSection(number) if section is None else section
+            for number, section in sorted(snapshot.sections.items())
+        ]
+        return pepfile.PepFile.create(
+            snapshot.path, snapshot.path, snapshot.pdfData, sections
+        )
+
+    def snapshotWritten(self, snapshot, pep):
+        if not snapshot.append:
+            self._sectionDigests = {}
+            for page in self.pages:
+                if page.hasPendingSection():
+                    page.setPendingSection(pep, pepfile.VERSION)
+        for number, digest in snapshot.digests.items():
+            if number in snapshot.sections:
+                self._sectionDigests[number] = digest
+        self.file = pep
+        # Changes made while the snapshot was being written are not saved.
+        if self.undoStack.index() == snapshot.index:
+            self.undoStack.setClean()
 
     def save(self):
-        f = QtCore.QFile(self.path)
-        f.open(QtCore.QIODevice.WriteOnly)
-        stream = QtCore.QDataStream(f)
-        stream.writeUInt32(0x2a04c304)
-        version = 0
-        stream.writeUInt32(version)
-        stream.writeQString(self.path)
-        stream.writeBytes(self.pdfData)
-        stream.writeUInt32(len(self.pages))
-        for page in self.pages:
-            page.save(stream, version)
+        self.autosaver.wait()
+        snapshot = self.snapshot()
+        self.snapshotWritten(snapshot, self.writeSnapshot(snapshot))
+
+    def sectionLoaded(self, page):
+        self._sectionDigests[page.number] = self._sectionDigest(
+            page, self.pageSection(page)
+        )
+
+    def _sectionDigest(self, page, section):
+        # Pages without annotations are recorded as None.
+        if not page.objects:
+            return None
+        return hashlib.sha1(section).digest()
 
     def saveas(self, path):
         self.path = str(path)
@@ -213,58 +585,56 @@ class Project(QtCore.QObject):
         if stream.readUInt32() != 0x2a04c304:
             return None
         version = stream.readUInt32()
-        if version > 0:
+        if version > pepfile.VERSION:
             return None
-        self.path = stream.readQString()
-        pdfData = stream.readBytes()
-        self.load_pdf(pdfData)
-        pages = stream.readUInt32()
-        for i in range(pages - len(self.pages)):
-            self.addPage()
-        for page in self.pages:
-            page.load(stream, version)
+        if version == 0:
+            self.path = stream.readQString()
+            pdfData = stream.readBytes()
+            self.load_pdf(pdfData)
+            pages = stream.readUInt32()
+            for i in range(pages - len(self.pages)):
+                self.addPage()
+            for page in self.pages:
+                page.load(stream, version)
+            self._pdfSource = None
+            self.file = None
+        else:
+            f.close()
+            pep = pepfile.PepFile.open(path)
+            self.path = pep.project_path
+            self.load_pdf(pep.mapPdf())
+            # Release the old map only now that nothing uses it.
+            self._pdfSource = pep
+            self.file = pep
+            for page in self.pages:
+                if pep.hasAnnotations(page.number):
+                    page.setPendingSection(pep, version)
+        self._sectionDigests = {
+            page.number: self._sectionDigest(page, self.pageSection(page))
+            for page in self.pages
+            if not page.hasPendingSection()
+        }
         self.changeFont(self.font)
 
     def addPage():
         pass
 
-    def export(self, path):
-        printer = QtPrintSupport.QPrinter()
-        printer.setColorMode(QtPrintSupport.QPrinter.Color)
-        printer.setOutputFormat(QtPrintSupport.QPrinter.PdfFormat)
-        printer.setOutputFileName(path + "~1")
-        printer.setPageMargins(0, 0, 0, 0, QtPrintSupport.QPrinter.Point)
-        page = self.document.page(0)
-        printer.setPaperSize(page.pageSizeF(), QtPrintSupport.QPrinter.Point)
-
-        painter = QtGui.QPainter()
-        if not painter.begin(printer):
-            return
-
-        first = True
-        for page in self.pages:
-            if first:
-                first = False
-            else:
-                printer.newPage()
-            page.pageItem.hide()
-            bg = page.scene.backgroundBrush()
-            page.scene.setBackgroundBrush(QtGui.QBrush(QtCore.Qt.NoBrush))
-            page.scene.render(painter, QtCore.QRectF(), page.pageItem.boundingRect())
-            page.scene.setBackgroundBrush(bg)
-            page.pageItem.show()
-        painter.end()
-        del painter
-        del printer
-        f = QtCore.QFile(path + "~2")
-        f.open(QtCore.QIODevice.WriteOnly)
-        f.write(self.pdfData)
-        f.close()
-        subprocess.call(
-            ["pdftk", path + "~1", "multibackground", path + "~2", "output", path]
-        )
-        os.remove(path + "~1")
-        os.remove(path + "~2")
+    def export(self, path, jobs=1, progress=None):
+        # Draw the annotations into an in-memory PDF and stamp its pages
+        # onto the original ones. Pages without annotations are copied as is.
+        # With more than one job the overlays are drawn by worker processes
+        # from the serialized pages. progress(done, total) is called as
+        # they finish and may return False to cancel the export.
+        # Returns whether the file was written.
+        pages = [page for page in self.pages if page.hasAnnotations()]
+        if jobs > 1 and len(pages) > 1:
+            stamps = render_parallel(self, pages, jobs, progress)
+        else:
+            stamps = render_overlay(self, pages)
+        if stamps is None:
+            return False
+        merge_overlay(self.pdfData, stamps, path)
+        return True
 
     def changeFont(self, font):
         self.font = font
@@ -283,7 +653,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.treeView.clearSelection()
         if page:
             self.treeView.selectionModel().setCurrentIndex(
-                self.project.treeModel.createIndex(0, 0, page),
+                self.project.treeModel.pageIndex(page),
                 QtCore.QItemSelectionModel.ClearAndSelect,
             )
 
@@ -291,11 +661,13 @@ class MainWindow(QtWidgets.QMainWindow):
         p = current.internalPointer()
         if isinstance(p, Page):
             self.setCurrentPage(p)
-        elif isinstance(p, ItemBase):
+        elif p is not None:
             self.setCurrentPage(p.page)
 
-    def __init__(self):
+    def __init__(self, exportJobs=1):
         QtCore.QObject.__init__(self)
+        # Number of worker processes drawing the annotations on export.
+        self.exportJobs = exportJobs
         uic.loadUi(
             os.path.join(os.path.dirname(os.path.realpath(__file__)), "main.ui"), self
         )
@@ -320,14 +692,30 @@ class MainWindow(QtWidgets.QMainWindow):
         toolGroup.addAction(self.actionTextTool)
         self.actionSizeTool.setChecked(True)
 
+        undoStack = self.project.undoStack
+        self.actionUndo.triggered.connect(undoStack.undo)
+        self.actionRedo.triggered.connect(undoStack.redo)
+        self.actionUndo.setEnabled(undoStack.canUndo())
+        self.actionRedo.setEnabled(undoStack.canRedo())
+        undoStack.canUndoChanged.connect(self.actionUndo.setEnabled)
+        undoStack.canRedoChanged.connect(self.actionRedo.setEnabled)
+
         self.treeView.setModel(self.project.treeModel)
         self.treeView.selectionModel().currentChanged.connect(self.currentObjectChanged)
 
+        self.continuousView.hide()
+        self.continuousView.pageActivated.connect(self.setCurrentPage)
+
+        self.project.autosaver.saved.connect(self.autosaved)
+        self.project.autosaver.failed.connect(self.autosaveFailed)
+        self.project.autosaver.start()
+
         self.handleFontChange()
 
     def doNewProject(self, path):
         self.setCurrentPage(None)
         self.project.create(path)
+        self.continuousView.setPages(self.project.pages)
         if self.project.pages:
             self.setCurrentPage(self.project.pages[0])
         self.handleFontChange()
@@ -344,8 +732,23 @@ class MainWindow(QtWidgets.QMainWindow):
         path = a + "_ann.pdf"
         # path = QtWidgets.QFileDialog.getSaveFileName(
         #     self, "Export pdf", "", "Pdf Documents (*.pdf);;All files (*)")
-        if path:
-            self.project.export(path)
+        if not path:
+            return False
+        dialog = QtWidgets.QProgressDialog("Exporting...", "Cancel", 0, 0, self)
+        dialog.setWindowModality(QtCore.Qt.WindowModal)
+        dialog.setMinimumDuration(500)
+
+        def progress(done, total):
+            dialog.setMaximum(total)
+            dialog.setValue(done)
+            QtWidgets.QApplication.processEvents()
+            return not dialog.wasCanceled()
+
+        written = self.project.export(path, self.exportJobs, progress)
+        dialog.close()
+        if not written:
+            self.statusbar.showMessage("Export cancelled", 5000)
+        return written
 
     def saveas(self):
         path = QtWidgets.QFileDialog.getSaveFileName(
@@ -360,6 +763,7 @@ class MainWindow(QtWidgets.QMainWindow):
     def doLoad(self, path):
         self.setCurrentPage(None)
         self.project.load(path)
+        self.continuousView.setPages(self.project.pages)
         if self.project.pages:
             self.setCurrentPage(self.project.pages[0])
 
@@ -379,6 +783,26 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             self.project.save()
 
+    def autosaved(self, snapshot_time, write_time):
+        self.statusbar.showMessage(
+            "Autosaved (snapshot %.0f ms, write %.0f ms)"
+            % (snapshot_time * 1000, write_time * 1000),
+            5000,
+        )
+
+    def autosaveFailed(self, message):
+        self.statusbar.showMessage("Autosave failed: %s" % message)
+
+    def setContinuous(self, continuous):
+        self.pageView.setVisible(not continuous)
+        self.continuousView.setVisible(continuous)
+        if continuous:
+            self.pageView.setScene(None)
+            self.continuousView.setZoom(self.pageView.zoom)
+        else:
+            self.pageView.setZoom(self.continuousView.zoom)
+            self.pageView.currentPageChanged(self.currentPage)
+
     def addImage(self):
         path = QtWidgets.QFileDialog.getOpenFileName(
             self,
@@ -390,16 +814,38 @@ class MainWindow(QtWidgets.QMainWindow):
         if path:
             pass
 
+    def activeView(self):
+        # The view showing the pages: pageView, or continuousView in
+        # continuous mode.
+        if self.continuousView.isHidden():
+            return self.pageView
+        return self.continuousView
+
     def addTextUnderCursor(self):
-        self.currentPage.addTextUnderCursor(self)
+        page, pos = self.activeView().pageAt(QtGui.QCursor.pos())
+        if page is not None:
+            page.addTextAt(pos)
+
+    def addLatexUnderCursor(self):
+        # Take the position before the dialog, which the cursor may leave.
+        page, pos = self.activeView().pageAt(QtGui.QCursor.pos())
+        if page is None:
+            return
+        source, ok = QtWidgets.QInputDialog.getMultiLineText(
+            self, "Add LaTeX", "LaTeX source:", "$$"
+        )
+        if ok and source:
+            page.addLatexAt(pos, source)
 
     def deleteSelection(self):
-        self.currentPage.deleteSelection()
+        page = self.activeView().focusPage()
+        if page is not None:
+            page.deleteSelection()
 
     def exportSaveAndQuit(self):
         self.save()
-        self.export()
-        self.close()
+        if self.export():
+            self.close()
 
     def handleFontChange(self, *_):
         font = self.fontCombo.currentFont()
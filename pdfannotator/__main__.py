@@ -1,22 +1,37 @@
 import os
 import sys
+import argparse
 
 from PyQt5 import QtWidgets
-from pdfannotator import MainWindow
+from pdfannotator import MainWindow, batch, importer
 
 
 def main():
     global a
-    app = QtWidgets.QApplication(sys.argv)
+    if sys.argv[1:2] == ["export"]:
+        sys.exit(batch.main(sys.argv[2:]))
+    if sys.argv[1:2] == ["import"]:
+        sys.exit(importer.main(sys.argv[2:]))
+    parser = argparse.ArgumentParser(prog="pdfannotator")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of processes drawing the annotations on export",
+    )
+    parser.add_argument("path", nargs="?")
+    args, qt_args = parser.parse_known_args()
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
 
-    a = MainWindow()
+    a = MainWindow(exportJobs=max(1, args.jobs))
     a.show()
-    if len(app.arguments()) > 1:
-        pep = os.path.splitext(str(app.arguments()[1]))[0] + ".pep"
+    if args.path:
+        pep = os.path.splitext(args.path)[0] + ".pep"
         if os.path.exists(pep):
             a.doLoad(pep)
         else:
-            a.doNewProject(app.arguments()[1])
+            a.doNewProject(args.path)
     sys.exit(app.exec_())
 
 
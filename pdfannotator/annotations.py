@@ -0,0 +1,106 @@
+import contextlib
+from PyQt5 import QtWidgets
+
+# Batches at least this large are added to or removed from a scene with
+# its BSP index switched off, so that the index is rebuilt once.
+BULK_SCENE_THRESHOLD = 64
+
+
+class AnnotationStore:
+    # The annotation items of a page in insertion order. Each item gets an
+    # ID when it is added, which stays the same until it is removed, so
+    # that items can be looked up by ID in constant time. The row of an
+    # item, which the tree model needs, comes from a map that is built on
+    # demand and dropped when a removal shifts the rows. Only
+    # ObjectTreeModel should change a store, so that views are notified.
+
+    def __init__(self):
+        self._items = {}
+        self._ids = {}
+        self._order = []
+        self._rows = None
+        self._next_id = 1
+
+    def __len__(self):
+        return len(self._order)
+
+    def __iter__(self):
+        return iter(self._order)
+
+    def __getitem__(self, row):
+        return self._order[row]
+
+    def __contains__(self, item):
+        return item in self._ids
+
+    def get(self, id):
+        return self._items.get(id)
+
+    def row(self, item):
+        if self._rows is None:
+            self._rows = {item: i for i, item in enumerate(self._order)}
+        return self._rows[item]
+
+    def _add(self, item):
+        id = self._next_id
+        self._next_id += 1
+        self._items[id] = item
+        self._ids[item] = id
+        return id
+
+    def add_many(self, items):
+        # Append items and return their new IDs.
+        ids = []
+        for item in items:
+            if self._rows is not None:
+                self._rows[item] = len(self._order)
+            self._order.append(item)
+            ids.append(self._add(item))
+        return ids
+
+    def insert_many(self, rows, items):
+        # Insert items so that they end up at the given rows, which must be
+        # ascending, in one pass, and return their new IDs.
+        order = []
+        rest = iter(self._order)
+        ids = []
+        for row, item in zip(rows, items):
+            while len(order) < row:
+                order.append(next(rest))
+            order.append(item)
+            ids.append(self._add(item))
+        order.extend(rest)
+        self._order = order
+        self._rows = None
+        return ids
+
+    def remove_many(self, items):
+        # Remove items in one pass over the rest.
+        for item in items:
+            del self._items[self._ids.pop(item)]
+        if items:
+            self._order = [item for item in self._order if item in self._ids]
+            self._rows = None
+
+    def remove_rows(self, first, last):
+        # Remove the items in rows first to last. Rows before first keep
+        # their numbers, so a batch of runs can be removed from the end.
+        for item in self._order[first : last + 1]:
+            del self._items[self._ids.pop(item)]
+        del self._order[first : last + 1]
+        self._rows = None
+
+
+@contextlib.contextmanager
+def bulk_scene(scene, count):
+    # Add or remove count items within the block without updating the
+    # scene's BSP index for each of them.
+    if count < BULK_SCENE_THRESHOLD:
+        yield
+        return
+    method = scene.itemIndexMethod()
+    scene.setItemIndexMethod(QtWidgets.QGraphicsScene.NoIndex)
+    try:
+        yield
+    finally:
+        scene.setItemIndexMethod(method)
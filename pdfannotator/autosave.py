@@ -0,0 +1,111 @@
+import os
+import time
+from PyQt5 import QtCore
+from .tasks import Task
+
+
+class Autosaver(QtCore.QObject):
+    # Saves the project in the background. Project.snapshot serializes the
+    # changed pages on the GUI thread, which only costs as much as the
+    # annotations; writing the file, including the PDF data on a full
+    # write, happens on a worker thread.
+    #
+    # An autosave is due `delay` ms after the undo stack leaves its clean
+    # state, and in any case every `interval` ms while there are changes.
+
+    # Seconds spent taking the snapshot and writing it.
+    saved = QtCore.pyqtSignal(float, float)
+    failed = QtCore.pyqtSignal(str)
+    _written = QtCore.pyqtSignal()
+
+    def __init__(self, project, interval=60000, delay=5000):
+        super().__init__()
+        self.project = project
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.autosave)
+        self.debounce = QtCore.QTimer(self)
+        self.debounce.setSingleShot(True)
+        self.debounce.setInterval(delay)
+        self.debounce.timeout.connect(self.autosave)
+        self.snapshotTime = None
+        self.writeTime = None
+        self._busy = False
+        # The outcome of the last write, until it is handled on this thread.
+        self._result = None
+        self._written.connect(self._onWritten)
+        # Follow the clean state through signals rather than asking the
+        # stack, which emits indexChanged from its destructor.
+        self._clean = project.undoStack.isClean()
+        project.undoStack.cleanChanged.connect(self._cleanChanged)
+        project.undoStack.indexChanged.connect(self._changed)
+
+    def start(self):
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+        self.debounce.stop()
+
+    def _cleanChanged(self, clean):
+        # Emitted after indexChanged, so the first change after a save
+        # starts the delay here.
+        self._clean = clean
+        if not clean:
+            self.debounce.start()
+
+    def _changed(self, index):
+        # Restart the delay on every change, so that a burst of edits
+        # is saved once.
+        if not self._clean:
+            self.debounce.start()
+
+    def autosave(self):
+        project = self.project
+        if self._busy or self._clean or project.document is None or not project.path:
+            return
+        if project.file is None and os.path.exists(project.path):
+            # The project was neither read from nor saved to its path, as
+            # when a PDF is opened next to an existing project; only a save
+            # started by the user may replace that file.
+            self.failed.emit("%s exists; save to replace it" % (project.path,))
+            return
+        start = time.perf_counter()
+        snapshot = project.snapshot()
+        snapshot_time = time.perf_counter() - start
+        if snapshot.append and not snapshot.sections:
+            project.undoStack.setClean()
+            return
+        self._busy = True
+        self.pool.start(Task(self._write, snapshot, snapshot_time))
+
+    def _write(self, snapshot, snapshot_time):
+        start = time.perf_counter()
+        try:
+            result = self.project.writeSnapshot(snapshot)
+        except (IOError, OSError, ValueError) as e:
+            result = e
+        self._result = (snapshot, result, snapshot_time, time.perf_counter() - start)
+        self._written.emit()
+
+    def _onWritten(self):
+        if self._result is None:
+            # Already handled by wait().
+            return
+        snapshot, result, snapshot_time, write_time = self._result
+        self._result = None
+        self._busy = False
+        if isinstance(result, Exception):
+            self.failed.emit(str(result))
+            return
+        self.project.snapshotWritten(snapshot, result)
+        self.snapshotTime = snapshot_time
+        self.writeTime = write_time
+        self.saved.emit(snapshot_time, write_time)
+
+    def wait(self):
+        # Finish a running autosave, including its bookkeeping on this thread.
+        self.pool.waitForDone()
+        self._onWritten()
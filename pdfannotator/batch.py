@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from . import Project
+from .export import init_offscreen
+
+
+def output_path(path):
+    return os.path.splitext(path)[0] + "_ann.pdf"
+
+
+def export_file(path):
+    # Load a project and export it without any widgets.
+    # Returns the output path, or raises if the export failed.
+    if not os.path.exists(path):
+        raise IOError("%s does not exist" % (path,))
+    project = Project(textLayout=False)
+    project.load(path)
+    if project.document is None:
+        raise ValueError("%s is not a project" % (path,))
+    output = output_path(path)
+    project.export(output)
+    return output
+
+
+def timed_export(path):
+    start = time.perf_counter()
+    try:
+        result = export_file(path)
+    except Exception as e:
+        result = e
+    return path, result, time.perf_counter() - start
+
+
+def export_files(paths, jobs=1):
+    # Export the projects at paths, spread over jobs processes,
+    # yielding (path, output path or exception, seconds) as they finish.
+    if jobs <= 1 or len(paths) <= 1:
+        init_offscreen()
+        for path in paths:
+            yield timed_export(path)
+        return
+    with multiprocessing.get_context("spawn").Pool(jobs, init_offscreen) as pool:
+        for result in pool.imap_unordered(timed_export, paths):
+            yield result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="pdfannotator export",
+        description="Export annotated PDFs of projects without opening a window.",
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of processes")
+    parser.add_argument("paths", nargs="+", metavar="project.pep")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    failed = 0
+    for path, result, seconds in export_files(args.paths, args.jobs):
+        if isinstance(result, Exception):
+            failed += 1
+            print(
+                "%s: failed after %.2f s: %s" % (path, seconds, result), file=sys.stderr
+            )
+        else:
+            print("%s: wrote %s in %.2f s" % (path, result, seconds))
+    print(
+        "Exported %d of %d projects in %.2f s"
+        % (len(args.paths) - failed, len(args.paths), time.perf_counter() - start)
+    )
+    return 1 if failed else 0
@@ -0,0 +1,106 @@
+from PyQt5 import QtWidgets
+
+# Undo command ids; commands with the same id may be merged.
+MOVE_ITEMS = 1
+GEOMETRY = 2
+
+# Number of undo steps to keep. The commands hold on to removed items,
+# so an unbounded stack would keep every deleted annotation alive.
+UNDO_LIMIT = 500
+
+
+class AddItemsCommand(QtWidgets.QUndoCommand):
+    # Adding any number of items is one step, undone with one remove_many.
+    def __init__(self, page, items, text="Add annotation"):
+        super().__init__(text)
+        self.page = page
+        self.items = list(items)
+
+    def redo(self):
+        self.page.add_many(self.items)
+
+    def undo(self):
+        self.page.remove_many(self.items)
+
+
+class RemoveItemsCommand(QtWidgets.QUndoCommand):
+    # Undoing puts the items back at their rows, so that the order of the
+    # page's annotations, and thus the saved page, is as before.
+    def __init__(self, page, items, text="Delete annotations"):
+        super().__init__(text)
+        self.page = page
+        self.items = list(items)
+        self.rows = None
+
+    def redo(self):
+        objects = self.page.objects
+        rows = sorted(
+            (objects.row(item), item) for item in self.items if item in objects
+        )
+        self.rows = [row for row, item in rows]
+        self.items = [item for row, item in rows]
+        self.page.remove_many(self.items)
+
+    def undo(self):
+        self.page.add_many(self.items, self.rows)
+
+
+class MoveItemsCommand(QtWidgets.QUndoCommand):
+    # Records the positions of items dragged in the scene. The items have
+    # already moved when it is pushed. Consecutive drags of the same items
+    # are merged into one step.
+    def __init__(self, moves, text="Move annotations"):
+        super().__init__(text)
+        # item -> (old position, new position)
+        self.moves = moves
+
+    def redo(self):
+        for item, (old, new) in self.moves.items():
+            item.setPos(new)
+
+    def undo(self):
+        for item, (old, new) in self.moves.items():
+            item.setPos(old)
+
+    def id(self):
+        return MOVE_ITEMS
+
+    def mergeWith(self, other):
+        if other.moves.keys() != self.moves.keys():
+            return False
+        for item, (old, new) in other.moves.items():
+            self.moves[item] = (self.moves[item][0], new)
+        return True
+
+
+class FontCommand(QtWidgets.QUndoCommand):
+    def __init__(self, items, font, text="Change font"):
+        super().__init__(text)
+        self.fonts = [(item, item.font()) for item in items]
+        self.font = font
+
+    def redo(self):
+        for item, old in self.fonts:
+            item.setFont(self.font)
+
+    def undo(self):
+        for item, old in self.fonts:
+            item.setFont(old)
+
+
+class TextEditCommand(QtWidgets.QUndoCommand):
+    # Stands for one step on the undo stack of a text item's document,
+    # which has already been done when the command is pushed.
+    def __init__(self, document, text="Edit text"):
+        super().__init__(text)
+        self.document = document
+        self._done = True
+
+    def redo(self):
+        if self._done:
+            self._done = False
+            return
+        self.document.redo()
+
+    def undo(self):
+        self.document.undo()
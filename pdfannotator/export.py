@@ -0,0 +1,186 @@
+import io
+import os
+import multiprocessing
+import PyPDF2
+from PyQt5 import QtGui, QtCore, QtWidgets
+from .widgets.pdfpageitem import page_rect
+
+
+def write_overlay(rects, draw):
+    # An in-memory PDF with one page the size of each rect;
+    # draw(painter, i) paints page i.
+    data = QtCore.QByteArray()
+    buf = QtCore.QBuffer(data)
+    buf.open(QtCore.QIODevice.WriteOnly)
+    writer = QtGui.QPdfWriter(buf)
+    writer.setPageMargins(QtCore.QMarginsF(0, 0, 0, 0))
+
+    painter = QtGui.QPainter()
+    try:
+        for i, rect in enumerate(rects):
+            writer.setPageSize(
+                QtGui.QPageSize(
+                    rect.size(), QtGui.QPageSize.Point, "", QtGui.QPageSize.ExactMatch
+                )
+            )
+            if i == 0:
+                if not painter.begin(writer):
+                    return None
+            else:
+                writer.newPage()
+            draw(painter, i)
+    finally:
+        if painter.isActive():
+            painter.end()
+    buf.close()
+    return bytes(data)
+
+
+def overlay_pages(overlay, numbers):
+    # Map the given page numbers to the pages of an overlay PDF.
+    if not numbers:
+        return {}
+    reader = PyPDF2.PdfFileReader(io.BytesIO(overlay))
+    return {number: reader.getPage(i) for i, number in enumerate(numbers)}
+
+
+def render_overlay(project, pages):
+    # Render the annotations of the given pages, without the pages
+    # themselves, and return the overlay pages by page number.
+    def draw(painter, i):
+        page = pages[i]
+        page.pageItem.hide()
+        bg = page.scene.backgroundBrush()
+        page.scene.setBackgroundBrush(QtGui.QBrush(QtCore.Qt.NoBrush))
+        page.scene.render(painter, QtCore.QRectF(), page.pageItem.boundingRect())
+        page.scene.setBackgroundBrush(bg)
+        page.pageItem.show()
+
+    rects = [page_rect(project.document.page(page.number)) for page in pages]
+    overlay = write_overlay(rects, draw)
+    if overlay is None:
+        return None
+    return overlay_pages(overlay, [page.number for page in pages])
+
+
+IDENTITY = [1, 0, 0, 1, 0, 0]
+
+
+def overlay_transform(page):
+    # Overlays are drawn in the frame Poppler shows a page in: its crop
+    # box, turned by /Rotate. Returns the matrix that takes that frame to
+    # the page's own user space.
+    box = page.cropBox
+    x0 = float(box.getLowerLeft_x())
+    y0 = float(box.getLowerLeft_y())
+    width = float(box.getWidth())
+    height = float(box.getHeight())
+    rotate = int(page["/Rotate"]) % 360 if "/Rotate" in page else 0
+    if rotate == 90:
+        return [0, 1, -1, 0, x0 + width, y0]
+    elif rotate == 180:
+        return [-1, 0, 0, -1, x0 + width, y0 + height]
+    elif rotate == 270:
+        return [0, -1, 1, 0, x0, y0 + height]
+    return [1, 0, 0, 1, x0, y0]
+
+
+def merge_overlay(pdfData, stamps, path):
+    # Stamp the overlay pages onto the original pages with the same
+    # numbers, copy the other pages through, and write the result to path.
+    original = PyPDF2.PdfFileReader(io.BytesIO(bytes(pdfData)))
+    output = PyPDF2.PdfFileWriter()
+    for i in range(original.getNumPages()):
+        page = original.getPage(i)
+        if i in stamps:
+            ctm = overlay_transform(page)
+            if ctm == IDENTITY:
+                page.mergePage(stamps[i])
+            else:
+                page.mergeTransformedPage(stamps[i], ctm)
+        output.addPage(page)
+    with open(path, "wb") as fp:
+        output.write(fp)
+
+
+class OverlayPage:
+    # Stands in for Page in a worker process: the items of a page section
+    # are created for it and drawn without a PdfPageItem or document.
+    myFont = None
+    project = None
+
+    def __init__(self, number):
+        self.number = number
+        self.objects = []
+
+
+_app = None
+
+
+def init_offscreen():
+    # Set up Qt for drawing without a display, in a worker process or a
+    # headless run.
+    global _app
+    os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    _app = QtWidgets.QApplication([])
+
+
+def render_fragment(pages):
+    # Runs in a worker process. pages is a list of
+    # (number, (x, y, width, height), section, version);
+    # returns the numbers and the overlay PDF of those pages.
+    from . import read_items
+
+    rects = []
+    scenes = []
+    for number, rect, section, version in pages:
+        scene = QtWidgets.QGraphicsScene()
+        stream = QtCore.QDataStream(QtCore.QByteArray(section))
+        for item in read_items(OverlayPage(number), stream, version):
+            scene.addItem(item)
+        rects.append(QtCore.QRectF(*rect))
+        scenes.append(scene)
+
+    def draw(painter, i):
+        scenes[i].render(painter, QtCore.QRectF(), rects[i])
+
+    return [page[0] for page in pages], write_overlay(rects, draw)
+
+
+def render_parallel(project, pages, jobs, progress=None, chunks_per_job=4):
+    # Render the overlays of pages on a pool of worker processes. The pages
+    # are serialized here and split into a few chunks per worker, so that
+    # progress can be reported as the chunks finish. Returns the overlay
+    # pages by page number, or None if progress asked to cancel.
+    work = []
+    for page in pages:
+        r = page_rect(project.document.page(page.number))
+        section, version = page.sectionData()
+        work.append(
+            (page.number, (r.x(), r.y(), r.width(), r.height()), section, version)
+        )
+    n = min(len(work), jobs * chunks_per_job)
+    chunks = [work[i * len(work) // n : (i + 1) * len(work) // n] for i in range(n)]
+
+    stamps = {}
+    pool = multiprocessing.get_context("spawn").Pool(jobs, init_offscreen)
+    try:
+        pending = [pool.apply_async(render_fragment, (chunk,)) for chunk in chunks]
+        while pending:
+            if progress is not None and progress(n - len(pending), n) is False:
+                return None
+            pending[0].wait(0.05)
+            done = [result for result in pending if result.ready()]
+            pending = [result for result in pending if result not in done]
+            for result in done:
+                numbers, overlay = result.get()
+                if overlay is None:
+                    raise IOError("Could not render the annotations")
+                stamps.update(overlay_pages(overlay, numbers))
+        if progress is not None:
+            progress(n, n)
+    finally:
+        # Also drops the chunks that are not drawn yet if we were cancelled.
+        pool.terminate()
+        pool.join()
+    return stamps
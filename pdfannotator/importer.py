@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import time
+import argparse
+from PyQt5 import QtCore
+from . import Project
+from .widgets.textitem import TextItem
+from .widgets.strikethrough import StrikethroughItem
+from .export import init_offscreen
+
+# Annotations are read from JSON Lines, one object per line:
+#
+#   {"page": 3, "kind": "strikethrough", "bbox": [x0, y0, x1, y1]}
+#   {"page": 3, "kind": "text", "position": [x, y], "text": "..."}
+#
+# Pages are numbered from 1, and coordinates are in points from the top
+# left corner of the page. A text annotation may give a bbox instead of a
+# position, in which case its top left corner is used.
+
+KINDS = ("strikethrough", "text")
+
+
+def read_annotations(fp):
+    for lineno, line in enumerate(fp, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError("line %d: %s" % (lineno, e))
+        if not isinstance(record, dict) or record.get("kind") not in KINDS:
+            raise ValueError("line %d: not a %s annotation" % (lineno, "/".join(KINDS)))
+        yield lineno, record
+
+
+def _rect(lineno, record):
+    try:
+        x0, y0, x1, y1 = map(float, record["bbox"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("line %d: bbox must be [x0, y0, x1, y1]" % (lineno,))
+    return QtCore.QRectF(QtCore.QPointF(x0, y0), QtCore.QPointF(x1, y1))
+
+
+def _position(lineno, record):
+    if "position" not in record:
+        return _rect(lineno, record).topLeft()
+    try:
+        x, y = map(float, record["position"])
+    except (TypeError, ValueError):
+        raise ValueError("line %d: position must be [x, y]" % (lineno,))
+    return QtCore.QPointF(x, y)
+
+
+def make_item(page, lineno, record):
+    if record["kind"] == "strikethrough":
+        return StrikethroughItem(page, _rect(lineno, record))
+    item = TextItem(page, page.myFont)
+    item.setPlainText(str(record.get("text", "")))
+    item.setPos(_position(lineno, record))
+    return item
+
+
+def import_annotations(project, records, batch_size=1000):
+    # Add the annotations in records, an iterable of (lineno, record), to
+    # the pages of project. Items are collected per page and added with
+    # Page.insertItems once batch_size of them are waiting, or at the end;
+    # the whole import is one step on the undo stack.
+    # Returns the number of annotations added.
+    pending = {}
+    count = 0
+    project.undoStack.beginMacro("Import annotations")
+    try:
+        for lineno, record in records:
+            number = record.get("page")
+            if not isinstance(number, int) or not 1 <= number <= len(project.pages):
+                raise ValueError("line %d: no page %r" % (lineno, number))
+            page = project.pages[number - 1]
+            items = pending.setdefault(page.number, [])
+            items.append(make_item(page, lineno, record))
+            if len(items) >= batch_size:
+                page.insertItems(pending.pop(page.number))
+                count += len(items)
+        for number, items in sorted(pending.items()):
+            project.pages[number].insertItems(items)
+            count += len(items)
+    finally:
+        project.undoStack.endMacro()
+    return count
+
+
+def import_file(source, annotations, output=None):
+    # Open a project, or create one for a PDF, add the annotations in the
+    # JSON Lines file annotations, and save it to output or to the
+    # project's own path. Returns the number of annotations and the path.
+    # As when a PDF is opened in the window, a PDF whose project exists
+    # next to it opens that project, so that it is added to and not
+    # replaced.
+    if not os.path.exists(source):
+        raise IOError("%s does not exist" % (source,))
+    project = Project(textLayout=False)
+    base, ext = os.path.splitext(source)
+    if ext.lower() != ".pep" and os.path.exists(base + ".pep"):
+        source = base + ".pep"
+        ext = ".pep"
+    if ext.lower() == ".pep":
+        project.load(source)
+        if project.document is None:
+            raise ValueError("%s is not a project" % (source,))
+    else:
+        project.create(source)
+    with open(annotations) as fp:
+        count = import_annotations(project, read_annotations(fp))
+    if output:
+        project.saveas(output)
+    else:
+        project.save()
+    return count, project.path
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="pdfannotator import",
+        description="Add annotations from a JSON Lines file to a project "
+        "without opening a window.",
+    )
+    parser.add_argument("source", metavar="project.pep|document.pdf")
+    parser.add_argument("annotations", metavar="annotations.jsonl")
+    parser.add_argument("-o", "--output", help="where to save the project")
+    args = parser.parse_args(argv)
+
+    init_offscreen()
+    start = time.perf_counter()
+    try:
+        count, path = import_file(args.source, args.annotations, args.output)
+    except (IOError, OSError, ValueError) as e:
+        print("%s: %s" % (args.annotations, e), file=sys.stderr)
+        return 1
+    print(
+        "Added %d annotations to %s in %.2f s"
+        % (count, path, time.perf_counter() - start)
+    )
+    return 0
@@ -1,77 +1,262 @@
+import io
 import os
+import hashlib
 import tempfile
 import subprocess
+import collections
 import PyPDF2
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+from PyQt5 import QtCore
+from .tasks import Task
+from .rendercache import SizedLRUCache
 
+BOX_TEMPLATE = r"""
+\setbox0=\hbox{%%
+%% \begin{minipage}{%%(width/stretch)gbp}%%
+%% \fontsize{%%(fontsize)g}{%%(fontsize * 6 / 5)dbp}\selectfont
+%% %%(fontsize_string)s
+\ipesetcolor
+%% minipage style???
+%(element)s%%
+\iperesetcolor}
+\count0=\dp0%%
+\divide\count0 by \bigpoint
+\pdfxform attr{/IpeId %(ipeid)s /IpeDepth \the\count0}0%%
+\pdfrefxform\pdflastxform
+""".strip()
 
-def compile_tex(sources):
-    box_tex = r"""
-    \setbox0=\hbox{%%
-    %% \begin{minipage}{%%(width/stretch)gbp}%%
-    %% \fontsize{%%(fontsize)g}{%%(fontsize * 6 / 5)dbp}\selectfont
-    %% %%(fontsize_string)s
-    \ipesetcolor
-    %% minipage style???
-    %(element)s%%
-    \iperesetcolor}
-    \count0=\dp0%%
-    \divide\count0 by \bigpoint
-    \pdfxform attr{/IpeId %(ipeid)s /IpeDepth \the\count0}0%%
-    \pdfrefxform\pdflastxform
-    """.strip()
+TEMPLATE = r"""\pdfcompresslevel0
+\nonstopmode
+\documentclass{article}
+\newcommand{\PageTitle}[1]{#1}
+\newdimen\ipefs
+\newcommand{\ipesymbol}[4]{\ipefs 1ex\pdfliteral{(#1) (\the\ipefs) (#2) (#3) (#4) sym}}
+\usepackage{color}
+\definecolor{black}{gray}{0}
+\definecolor{red}{rgb}{1,0,0}
+\def\ipesetcolor{\pdfcolorstack0 push{0 0 0 0 k 0 0 0 0 K}}
+\def\iperesetcolor{\pdfcolorstack0 pop}
+%(preamble)s%%
+\pagestyle{empty}
+\newcount\bigpoint\dimen0=0.01bp\bigpoint=\dimen0
+\begin{document}
+%(boxes)s%%
+\hbox{}
+\end{document}
+"""
 
+# A compiled box: a one-page PDF showing just the box, its size in bp,
+# and how far it extends below the baseline.
+Box = collections.namedtuple("Box", "pdf width height depth")
+
+
+class LatexError(Exception):
+    def __init__(self, message, log=""):
+        super().__init__(message)
+        self.log = log
+
+
+def error_message(log):
+    # The first TeX error in a pdflatex log.
+    for line in log.splitlines():
+        if line.startswith("!"):
+            return line[1:].strip()
+    return None
+
+
+def box_key(source, preamble=""):
+    # Boxes are cached by everything that goes into compiling them.
+    h = hashlib.sha1()
+    for part in (TEMPLATE, BOX_TEMPLATE, preamble, source):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def compile_tex(sources, preamble=""):
+    # Run pdflatex on one document with a form XObject per source, tagged
+    # with its index as /IpeId, and return the resulting PDF data.
+    # Raises LatexError if pdflatex fails.
     boxes = [
-        box_tex % dict(element=source, stretch=1, ipeid=i)
+        BOX_TEMPLATE % dict(element=source, stretch=1, ipeid=i)
         for i, source in enumerate(sources)
     ]
-
-    tex = r"""\pdfcompresslevel0
-    \nonstopmode
-    \documentclass{article}
-    \newcommand{\PageTitle}[1]{#1}
-    \newdimen\ipefs
-    \newcommand{\ipesymbol}[4]{\ipefs 1ex\pdfliteral{(#1) (\the\ipefs) (#2) (#3) (#4) sym}}
-    \usepackage{color}
-    \definecolor{black}{gray}{0}
-    \definecolor{red}{rgb}{1,0,0}
-    \def\ipesetcolor{\pdfcolorstack0 push{0 0 0 0 k 0 0 0 0 K}}
-    \def\iperesetcolor{\pdfcolorstack0 pop}
-    %(preamble)s%%
-    \pagestyle{empty}
-    \newcount\bigpoint\dimen0=0.01bp\bigpoint=\dimen0
-    \begin{document}
-    %(boxes)s%%
-    \hbox{}
-    \end{document}
-    """ % dict(
-        preamble="", boxes="".join(boxes)
-    )
-    with tempfile.NamedTemporaryFile(
-        "w", prefix="pdfannotator", suffix=".tex", delete=False
-    ) as fp:
-        fp.write(tex)
-        fp.close()
-        proc = subprocess.Popen(
-            ("pdflatex", fp.name),
-            stdin=subprocess.DEVNULL,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            cwd=os.path.dirname(fp.name),
-        )
+    tex = TEMPLATE % dict(preamble=preamble, boxes="".join(boxes))
+    with tempfile.TemporaryDirectory(prefix="pdfannotator") as directory:
+        with open(os.path.join(directory, "boxes.tex"), "w") as fp:
+            fp.write(tex)
+        try:
+            proc = subprocess.Popen(
+                ("pdflatex", "boxes.tex"),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+                cwd=directory,
+            )
+        except OSError as e:
+            raise LatexError("Could not run pdflatex: %s" % (e,))
         stdoutdata, stderrdata = proc.communicate()
         returncode = proc.wait()
         if returncode != 0 or stderrdata:
-            print(stdoutdata)
-            print(stderrdata)  # Should be empty
-            raise SystemExit("pdflatex returned exit status %d" % returncode)
-        return fp.name.replace(".tex", ".pdf")
+            message = (
+                error_message(stdoutdata)
+                or stderrdata.strip()
+                or "pdflatex returned exit status %d" % returncode
+            )
+            raise LatexError(message, stdoutdata)
+        with open(os.path.join(directory, "boxes.pdf"), "rb") as fp:
+            return fp.read()
+
+
+def box_pdf(xform_ref, bbox):
+    # A PDF whose only page is the form XObject, cropped to its bounding box.
+    x0, y0, x1, y1 = bbox
+    writer = PyPDF2.PdfFileWriter()
+    page = writer.addBlankPage(x1 - x0, y1 - y0)
+    content = DecodedStreamObject()
+    content.setData(b"q 1 0 0 1 %g %g cm /Box Do Q" % (-x0, -y0))
+    page[NameObject("/Contents")] = writer._addObject(content)
+    page[NameObject("/Resources")] = DictionaryObject(
+        {NameObject("/XObject"): DictionaryObject({NameObject("/Box"): xform_ref})}
+    )
+    fp = io.BytesIO()
+    writer.write(fp)
+    return fp.getvalue()
+
+
+def extract_boxes(data):
+    # The boxes in the output of compile_tex by their /IpeId.
+    pdf = PyPDF2.PdfFileReader(io.BytesIO(data))
+    xobjects = pdf.getPage(0)["/Resources"]["/XObject"]
+    boxes = {}
+    for xform_ref in xobjects.values():
+        xform = xform_ref.getObject()
+        if "/IpeId" not in xform:
+            continue
+        bbox = [float(v) for v in xform["/BBox"]]
+        x0, y0, x1, y1 = bbox
+        # /IpeDepth is in units of 0.01bp; see \bigpoint in TEMPLATE.
+        depth = int(xform["/IpeDepth"]) / 100
+        boxes[int(xform["/IpeId"])] = Box(
+            box_pdf(xform_ref, bbox), x1 - x0, y1 - y0, depth
+        )
+    return boxes
+
+
+class LatexCache(SizedLRUCache):
+    # Compiled boxes by box_key, bounded by the total size of their PDF data.
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        super().__init__(max_bytes, lambda box: len(box.pdf))
+
+
+def compile_boxes(sources, preamble="", cache=None):
+    # The compiled box of each source. Only the sources not in the cache
+    # are compiled, all in one pdflatex run. Raises LatexError if one of
+    # them does not compile.
+    if cache is None:
+        cache = LatexCache()
+    keys = [box_key(source, preamble) for source in sources]
+    found = {}
+    missing = {}
+    for key, source in zip(keys, sources):
+        box = cache.get(key)
+        if box is not None:
+            found[key] = box
+        else:
+            missing.setdefault(key, source)
+    for key, result in compile_sources(missing, preamble).items():
+        if isinstance(result, LatexError):
+            raise result
+        found[key] = result
+        cache.put(key, result)
+    return [found[key] for key in keys]
+
+
+def compile_sources(sources, preamble=""):
+    # Compile the sources in {key: source} and return {key: Box or
+    # LatexError}. If the run fails, the sources are split in halves and
+    # compiled again, so that one broken box does not fail the others.
+    if not sources:
+        return {}
+    try:
+        boxes = extract_boxes(compile_tex(list(sources.values()), preamble))
+    except LatexError as e:
+        if len(sources) == 1:
+            return {key: e for key in sources}
+        items = list(sources.items())
+        results = compile_sources(dict(items[: len(items) // 2]), preamble)
+        results.update(compile_sources(dict(items[len(items) // 2 :]), preamble))
+        return results
+    return {
+        key: boxes.get(i) or LatexError("pdflatex produced no box")
+        for i, key in enumerate(sources)
+    }
+
+
+class LatexService(QtCore.QObject):
+    # Compiles LaTeX boxes on a worker thread. Boxes requested within
+    # `delay` ms of the first queued one are compiled in one pdflatex run;
+    # boxes in the cache are answered at once.
+
+    _compiled = QtCore.pyqtSignal(object)
+
+    def __init__(self, cache=None, delay=100):
+        super().__init__()
+        self.cache = cache or LatexCache()
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(delay)
+        self.timer.timeout.connect(self._flush)
+        # Sources waiting for the timer by preamble, and the callbacks
+        # waiting for each queued or running box.
+        self._queued = {}
+        self._callbacks = {}
+        self._compiled.connect(self._deliver)
+
+    def request(self, source, callback, preamble=""):
+        # callback(box, error) gets the Box, or None and a LatexError.
+        key = box_key(source, preamble)
+        box = self.cache.get(key)
+        if box is not None:
+            callback(box, None)
+            return
+        callbacks = self._callbacks.setdefault(key, [])
+        callbacks.append(callback)
+        if len(callbacks) == 1:
+            self._queued.setdefault(preamble, {})[key] = source
+            if not self.timer.isActive():
+                self.timer.start()
+
+    def cancel(self, callback):
+        for callbacks in self._callbacks.values():
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def _flush(self):
+        for preamble, sources in self._queued.items():
+            self.pool.start(Task(self._compile, preamble, sources))
+        self._queued = {}
+
+    def _compile(self, preamble, sources):
+        self._compiled.emit(compile_sources(sources, preamble))
+
+    def _deliver(self, results):
+        for key, result in results.items():
+            if isinstance(result, LatexError):
+                box, error = None, result
+            else:
+                box, error = result, None
+                self.cache.put(key, box)
+            for callback in self._callbacks.pop(key, []):
+                callback(box, error)
 
 
 def main():
-    filename = compile_tex(["Hello worlg!", r"$\sum_{i=1}^\infty 1/i$"])
-    fp = open(filename, "rb")
-    pdf = PyPDF2.PdfFileReader(fp)
+    data = compile_tex(["Hello worlg!", r"$\sum_{i=1}^\infty 1/i$"])
+    pdf = PyPDF2.PdfFileReader(io.BytesIO(data))
     page1 = pdf.getPage(0)
     print(page1["/Contents"])
     print(page1["/Contents"]._data)
@@ -0,0 +1,184 @@
+import os
+import threading
+from PyQt5 import QtCore
+
+# Layout of a version 1 .pep file:
+#
+#   UInt32 magic, UInt32 version, UInt64 offset of the current index,
+#   QString project path, Bytes PDF data,
+#   then page sections and indexes in the order they were appended.
+#
+# A page section is the Page.save output of one page, stored as Bytes.
+# An index is the offset and size of the PDF data followed by the offsets
+# and sizes of the current section of every page. Saving appends the changed
+# sections and a new index, and then points the header at the new index,
+# so that an interrupted save leaves the previous state readable.
+
+MAGIC = 0x2A04C304
+VERSION = 1
+INDEX_POINTER = 8
+
+# Size of a stored section of a page without annotations.
+EMPTY_SECTION_SIZE = 8
+
+# Rewrite the file once superseded sections take up this much of it.
+COMPACT_RATIO = 0.25
+COMPACT_MIN_BYTES = 4 * 1024 * 1024
+
+
+def _bytes_size(data):
+    return 4 + len(data)
+
+
+class PepFile:
+    def __init__(self, path):
+        self.path = path
+        self.project_path = None
+        self.pdf_offset = None
+        self.pdf_size = None
+        self.offsets = []
+        self.sizes = []
+        self.index_offset = None
+        self.end = None
+        self.garbage = 0
+        self._mapFile = None
+        self._mapped = None
+        # Sections are read through one handle kept open from the start,
+        # so that they come from this file even after a save has renamed
+        # a new file over it. Saves may read it from a worker thread.
+        self._readFile = None
+        self._readLock = threading.Lock()
+
+    @classmethod
+    def create(cls, path, project_path, pdfData, sections):
+        # Write a complete file next to path and rename it into place.
+        pep = cls(path)
+        pep.project_path = project_path
+        tmp = path + "~"
+        f = QtCore.QFile(tmp)
+        if not f.open(QtCore.QIODevice.WriteOnly):
+            raise IOError("Could not write %s" % (tmp,))
+        stream = QtCore.QDataStream(f)
+        stream.writeUInt32(MAGIC)
+        stream.writeUInt32(VERSION)
+        stream.writeUInt64(0)
+        stream.writeQString(project_path)
+        pep.pdf_offset = f.pos()
+        pep.pdf_size = len(pdfData)
+        stream.writeBytes(pdfData)
+        for section in sections:
+            pep.offsets.append(f.pos())
+            pep.sizes.append(_bytes_size(section))
+            stream.writeBytes(section)
+        pep._writeIndex(f, stream)
+        f.close()
+        os.replace(tmp, path)
+        return pep
+
+    @classmethod
+    def open(cls, path):
+        pep = cls(path)
+        f = QtCore.QFile(path)
+        if not f.open(QtCore.QIODevice.ReadOnly):
+            raise IOError("Could not read %s" % (path,))
+        pep._readFile = f
+        stream = QtCore.QDataStream(f)
+        if stream.readUInt32() != MAGIC or stream.readUInt32() != VERSION:
+            raise ValueError("%s is not a version %d project" % (path, VERSION))
+        pep.index_offset = stream.readUInt64()
+        pep.project_path = stream.readQString()
+        f.seek(pep.index_offset)
+        pep.pdf_offset = stream.readUInt64()
+        pep.pdf_size = stream.readUInt64()
+        count = stream.readUInt32()
+        pep.offsets = [stream.readUInt64() for i in range(count)]
+        pep.sizes = [stream.readUInt32() for i in range(count)]
+        pep.end = f.size()
+        if stream.status() != QtCore.QDataStream.Ok:
+            raise ValueError("%s is corrupt" % (path,))
+        live = pep.pdf_offset + 4 + pep.pdf_size + sum(pep.sizes)
+        pep.garbage = max(0, pep.end - live - pep._indexSize())
+        return pep
+
+    def _indexSize(self):
+        return 8 + 8 + 4 + 12 * len(self.offsets)
+
+    def _writeIndex(self, f, stream):
+        self.index_offset = f.pos()
+        stream.writeUInt64(self.pdf_offset)
+        stream.writeUInt64(self.pdf_size)
+        stream.writeUInt32(len(self.offsets))
+        for offset in self.offsets:
+            stream.writeUInt64(offset)
+        for size in self.sizes:
+            stream.writeUInt32(size)
+        self.end = f.pos()
+        f.flush()
+        os.fsync(f.handle())
+        f.seek(INDEX_POINTER)
+        stream.writeUInt64(self.index_offset)
+
+    def canAppend(self, path):
+        # Only append to the file we wrote or read last, and only if
+        # nobody else has changed it since.
+        return (
+            os.path.abspath(path) == os.path.abspath(self.path)
+            and os.path.exists(path)
+            and os.path.getsize(path) == self.end
+        )
+
+    def needsCompaction(self):
+        return self.garbage > max(COMPACT_MIN_BYTES, self.end * COMPACT_RATIO)
+
+    def append(self, sections):
+        # sections maps page numbers to their new section data.
+        f = QtCore.QFile(self.path)
+        if not f.open(QtCore.QIODevice.ReadWrite):
+            raise IOError("Could not write %s" % (self.path,))
+        stream = QtCore.QDataStream(f)
+        f.seek(self.end)
+        self.garbage += self._indexSize()
+        for number, section in sorted(sections.items()):
+            self.garbage += self.sizes[number]
+            self.offsets[number] = f.pos()
+            self.sizes[number] = _bytes_size(section)
+            stream.writeBytes(section)
+        self._writeIndex(f, stream)
+        f.close()
+
+    def readPdf(self):
+        return self._readBytes(self.pdf_offset)
+
+    def mapPdf(self):
+        # The PDF data as a QByteArray over a memory map of the file, so
+        # that Poppler reads it from the page cache instead of a copy.
+        # The map lives as long as this PepFile.
+        f = QtCore.QFile(self.path)
+        if not f.open(QtCore.QIODevice.ReadOnly):
+            raise IOError("Could not read %s" % (self.path,))
+        ptr = f.map(self.pdf_offset + 4, self.pdf_size)
+        if ptr is None or not int(ptr):
+            f.close()
+            return self.readPdf()
+        ptr.setsize(self.pdf_size)
+        self._mapFile = f
+        self._mapped = ptr
+        return QtCore.QByteArray.fromRawData(ptr)
+
+    def hasAnnotations(self, number):
+        return self.sizes[number] > EMPTY_SECTION_SIZE
+
+    def readSection(self, number):
+        return self._readBytes(self.offsets[number])
+
+    def _readBytes(self, offset):
+        with self._readLock:
+            if self._readFile is None:
+                f = QtCore.QFile(self.path)
+                if not f.open(QtCore.QIODevice.ReadOnly):
+                    raise IOError("Could not read %s" % (self.path,))
+                self._readFile = f
+            self._readFile.seek(offset)
+            data = QtCore.QDataStream(self._readFile).readBytes()
+        # readBytes gives bytes, which QDataStream cannot read from.
+        return QtCore.QByteArray(data)
@@ -0,0 +1,93 @@
+import math
+import collections
+
+TILE_SIZE = 256
+MAX_LEVEL_OF_DETAIL = 8
+
+
+def quantize_zoom(d):
+    # Render at half-octave steps so that small zoom changes reuse tiles.
+    # The level is an integer so that it can be part of a cache key.
+    d = min(d, MAX_LEVEL_OF_DETAIL)
+    return math.ceil(math.log2(d) * 2)
+
+
+def zoom_for_level(level):
+    return 2.0 ** (level / 2)
+
+
+def tile_range(rect, d):
+    # Tile coordinates at zoom d of the tiles overlapping the QRectF rect.
+    left = max(0, math.floor(rect.left() * d / TILE_SIZE))
+    top = max(0, math.floor(rect.top() * d / TILE_SIZE))
+    right = math.ceil(rect.right() * d / TILE_SIZE)
+    bottom = math.ceil(rect.bottom() * d / TILE_SIZE)
+    return [(x, y) for y in range(top, bottom) for x in range(left, right)]
+
+
+def tile_rect(width, height, level, tx, ty):
+    # The (x, y, width, height) in pixels of a tile of a page that is
+    # width x height points, or None if the tile lies outside the page.
+    d = zoom_for_level(level)
+    x = tx * TILE_SIZE
+    y = ty * TILE_SIZE
+    w = min(TILE_SIZE, math.ceil(width * d) - x)
+    h = min(TILE_SIZE, math.ceil(height * d) - y)
+    if w <= 0 or h <= 0:
+        return None
+    return x, y, w, h
+
+
+class SizedLRUCache:
+    # LRU cache bounded by the total size of its values, as given by
+    # sizeof(value).
+    def __init__(self, max_bytes, sizeof):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._sizeof = sizeof
+        self._items = collections.OrderedDict()
+
+    def get(self, key):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def put(self, key, value):
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size -= self._sizeof(old)
+        self._items[key] = value
+        self.size += self._sizeof(value)
+        self._evict()
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def _evict(self):
+        # Never evict the most recent value, even if it alone is over budget.
+        while self.size > self.max_bytes and len(self._items) > 1:
+            key, value = self._items.popitem(last=False)
+            self.size -= self._sizeof(value)
+
+    def discard(self, keys):
+        for key in keys:
+            self.size -= self._sizeof(self._items.pop(key))
+
+    def clear(self):
+        self._items.clear()
+        self.size = 0
+
+
+class RenderCache(SizedLRUCache):
+    # Rendered page tiles, bounded by the total image size.
+    # Keys are (page number, zoom level, tile x, tile y).
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        super().__init__(max_bytes, lambda image: image.byteCount())
+
+    def discard_page(self, page_number):
+        self.discard([k for k in self._items if k[0] == page_number])
@@ -0,0 +1,159 @@
+import threading
+import popplerqt5
+from PyQt5 import QtCore, QtGui
+from .rendercache import zoom_for_level, tile_range, tile_rect
+from .widgets.pdfpageitem import page_rect
+
+
+def load_document(pdfData):
+    document = popplerqt5.Poppler.Document.loadFromData(pdfData)
+    document.setRenderHint(popplerqt5.Poppler.Document.Antialiasing, True)
+    document.setRenderHint(popplerqt5.Poppler.Document.TextAntialiasing, True)
+    return document
+
+
+# Poppler documents must not be shared between threads,
+# so every worker thread loads its own copy.
+_thread_state = threading.local()
+
+
+def thread_document(document_key, pdfData):
+    if getattr(_thread_state, "document_key", None) != document_key:
+        _thread_state.document = load_document(pdfData)
+        _thread_state.document_key = document_key
+    return _thread_state.document
+
+
+class RenderJob(QtCore.QRunnable):
+    def __init__(self, document_key, pdfData, key, rect, finished):
+        super().__init__()
+        self.document_key = document_key
+        self.pdfData = pdfData
+        self.key = key
+        self.rect = rect
+        self.finished = finished
+        self.callbacks = []
+        self.cancelled = False
+
+    def run(self):
+        if self.cancelled:
+            return
+        document = thread_document(self.document_key, self.pdfData)
+        page_number, level = self.key[:2]
+        d = zoom_for_level(level)
+        x, y, w, h = self.rect
+        image = document.page(page_number).renderToImage(72 * d, 72 * d, x, y, w, h)
+        if not self.cancelled:
+            self.finished.emit(self, image)
+
+
+class RenderService(QtCore.QObject):
+    # Renders cache tiles on a thread pool. Requests are keyed like the
+    # RenderCache; finished images are put in the cache on the GUI thread
+    # and then the callbacks given to request() are called.
+
+    _finished = QtCore.pyqtSignal(object, QtGui.QImage)
+
+    def __init__(self, cache, threads=None):
+        super().__init__()
+        self.cache = cache
+        self.pool = QtCore.QThreadPool(self)
+        if threads is None:
+            threads = min(4, QtCore.QThread.idealThreadCount())
+        self.pool.setMaxThreadCount(max(1, threads))
+        self._pdfData = None
+        self._generation = 0
+        self._pending = {}
+        self._finished.connect(self._deliver)
+
+    def setDocument(self, pdfData):
+        # Wait for running jobs, as pdfData may be a map of a file
+        # that is about to be closed.
+        self.cancel()
+        self.pool.clear()
+        self.pool.waitForDone()
+        self.cache.clear()
+        self._pdfData = pdfData
+        self._generation += 1
+
+    def request(self, key, rect, callback=None, priority=0):
+        # rect is the (x, y, width, height) of the tile in pixels.
+        # Jobs with a higher priority are started first.
+        job = self._pending.get(key)
+        if job is None:
+            job = RenderJob(
+                (id(self), self._generation), self._pdfData, key, rect, self._finished
+            )
+            self._pending[key] = job
+            self.pool.start(job, priority)
+        if callback is not None and callback not in job.callbacks:
+            job.callbacks.append(callback)
+
+    def cancel(self, predicate=None):
+        for key, job in list(self._pending.items()):
+            if predicate is None or predicate(key):
+                job.cancelled = True
+                del self._pending[key]
+
+    def _deliver(self, job, image):
+        if job.cancelled or self._pending.get(job.key) is not job:
+            return
+        del self._pending[job.key]
+        self.cache.put(job.key, image)
+        for callback in job.callbacks:
+            callback()
+
+
+class Prefetcher:
+    # Renders the pages around the current page into the render cache
+    # before they are shown. Stepping through pages in one direction
+    # extends the prefetch in that direction, up to max_depth pages.
+
+    def __init__(self, project, max_depth=4):
+        self.project = project
+        self.max_depth = max_depth
+        self.reset()
+
+    def reset(self):
+        self._last = None
+        self._direction = 0
+        self._streak = 0
+
+    def neighbours(self, number):
+        step = None if self._last is None else number - self._last
+        if step in (-1, 1):
+            self._streak = self._streak + 1 if step == self._direction else 1
+            self._direction = step
+        else:
+            self._streak = 0
+            self._direction = 0
+        self._last = number
+
+        if self._direction:
+            ahead = min(self.max_depth, 1 + self._streak)
+            pages = [number + self._direction * i for i in range(1, ahead + 1)]
+            pages.append(number - self._direction)
+        else:
+            pages = [number + 1, number - 1]
+        count = self.project.document.numPages()
+        return [n for n in pages if 0 <= n < count]
+
+    def pageChanged(self, number, level, rect):
+        # rect is the part of the page in view, which we assume
+        # will also be in view on the neighbouring pages.
+        renderer = self.project.renderer
+        pages = self.neighbours(number)
+        wanted = set(pages)
+        wanted.add(number)
+        renderer.cancel(
+            lambda key: key[0] not in wanted or (key[0] != number and key[1] != level)
+        )
+        d = zoom_for_level(level)
+        for distance, n in enumerate(pages, 1):
+            size = page_rect(self.project.document.page(n))
+            for tx, ty in tile_range(rect.intersected(size), d):
+                key = (n, level, tx, ty)
+                tile = tile_rect(size.width(), size.height(), level, tx, ty)
+                if tile is None or key in renderer.cache:
+                    continue
+                renderer.request(key, tile, priority=-distance)
@@ -0,0 +1,12 @@
+from PyQt5 import QtCore
+
+
+class Task(QtCore.QRunnable):
+    # Runs fn(*args) on a QThreadPool.
+    def __init__(self, fn, *args):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+
+    def run(self):
+        self.fn(*self.args)
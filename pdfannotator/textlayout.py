@@ -0,0 +1,158 @@
+import os
+import hashlib
+import numpy as np
+from PyQt5 import QtCore
+from .renderer import thread_document
+from .tasks import Task
+from .widgets.pdfpageitem import PageText, partition_into_lines
+
+LAYOUT_MAGIC = 0x2A04C3A7
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "pdfannotator", "textlayout")
+
+
+def pdf_digest(pdfData, chunk_size=1 << 20):
+    # The SHA-1 of the PDF, a chunk at a time, so that a document of
+    # hundreds of MB, possibly memory-mapped, is never copied whole.
+    h = hashlib.sha1()
+    for offset in range(0, pdfData.size(), chunk_size):
+        h.update(pdfData.mid(offset, chunk_size).data())
+    return h.hexdigest()
+
+
+def write_layout(path, pages):
+    tmp = path + ".tmp"
+    f = QtCore.QFile(tmp)
+    if not f.open(QtCore.QIODevice.WriteOnly):
+        return False
+    stream = QtCore.QDataStream(f)
+    stream.writeUInt32(LAYOUT_MAGIC)
+    version = 1
+    stream.writeUInt32(version)
+    stream.writeUInt32(len(pages))
+    for number, text in sorted(pages.items()):
+        # The arrays are stored in native byte order;
+        # the cache is not meant to move between machines.
+        stream.writeUInt32(number)
+        stream.writeBytes(text.word_boxes.tobytes())
+        stream.writeQString(text.text)
+        stream.writeBytes(text.text_offsets.tobytes())
+        stream.writeBytes(text.line_starts.tobytes())
+    f.close()
+    os.replace(tmp, path)
+    return True
+
+
+def read_layout(path):
+    f = QtCore.QFile(path)
+    if not f.open(QtCore.QIODevice.ReadOnly):
+        return {}
+    stream = QtCore.QDataStream(f)
+    if stream.readUInt32() != LAYOUT_MAGIC:
+        return {}
+    version = stream.readUInt32()
+    if version != 1:
+        # Version 0 stored Line/Word tuples; such caches are re-extracted.
+        return {}
+    pages = {}
+    for i in range(stream.readUInt32()):
+        number = stream.readUInt32()
+        word_boxes = np.frombuffer(bytes(stream.readBytes()), dtype=np.float32)
+        text = stream.readQString()
+        text_offsets = np.frombuffer(bytes(stream.readBytes()), dtype=np.int32)
+        line_starts = np.frombuffer(bytes(stream.readBytes()), dtype=np.int32)
+        if stream.status() != QtCore.QDataStream.Ok:
+            return {}
+        pages[number] = PageText(word_boxes, text, text_offsets, line_starts)
+    if stream.status() != QtCore.QDataStream.Ok:
+        return {}
+    return pages
+
+
+class TextLayoutService(QtCore.QObject):
+    # Extracts the text layout of every page on a thread pool once a
+    # document is loaded, and keeps it in a cache file named after the
+    # hash of the PDF, so that the next session can skip the extraction.
+
+    _loaded = QtCore.pyqtSignal(int, str, object)
+    _extracted = QtCore.pyqtSignal(int, int, object)
+
+    def __init__(self, cache_dir=None, threads=2):
+        super().__init__()
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(threads)
+        self._generation = 0
+        self._pdfData = None
+        self._count = 0
+        self._digest = None
+        self._pages = {}
+        self._dirty = False
+        self._loaded.connect(self._onLoaded)
+        self._extracted.connect(self._onExtracted)
+
+    def setDocument(self, pdfData, page_count):
+        self.pool.clear()
+        self.pool.waitForDone()
+        self._generation += 1
+        self._pdfData = pdfData
+        self._count = page_count
+        self._digest = None
+        self._pages = {}
+        self._dirty = False
+        self.pool.start(Task(self._load, self._generation, pdfData))
+
+    def lines(self, number, document):
+        # The layout of a page, extracted on the calling thread if the
+        # workers have not got to it yet.
+        lines = self._pages.get(number)
+        if lines is None:
+            lines = partition_into_lines(document.page(number).textList())
+            self._pages[number] = lines
+            self._dirty = True
+            self._maybeSave()
+        return lines
+
+    def _path(self):
+        return os.path.join(self.cache_dir, self._digest + ".layout")
+
+    def _load(self, generation, pdfData):
+        digest = pdf_digest(pdfData)
+        pages = read_layout(os.path.join(self.cache_dir, digest + ".layout"))
+        self._loaded.emit(generation, digest, pages)
+
+    def _onLoaded(self, generation, digest, pages):
+        if generation != self._generation:
+            return
+        self._digest = digest
+        for number, lines in pages.items():
+            self._pages.setdefault(number, lines)
+        for number in range(self._count):
+            if number not in self._pages:
+                self._dirty = True
+                self.pool.start(Task(self._extract, generation, self._pdfData, number))
+
+    def _extract(self, generation, pdfData, number):
+        if generation != self._generation:
+            return
+        document = thread_document((id(self), generation), pdfData)
+        lines = partition_into_lines(document.page(number).textList())
+        self._extracted.emit(generation, number, lines)
+
+    def _onExtracted(self, generation, number, lines):
+        if generation != self._generation:
+            return
+        self._pages.setdefault(number, lines)
+        self._maybeSave()
+
+    def _maybeSave(self):
+        if not self._dirty or self._digest is None:
+            return
+        if len(self._pages) < self._count:
+            return
+        self._dirty = False
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.pool.start(Task(write_layout, self._path(), dict(self._pages)))
@@ -0,0 +1,210 @@
+import bisect
+from PyQt5 import QtGui, QtWidgets, QtCore
+from .pdfpageitem import page_rect
+
+
+class ContinuousView(QtWidgets.QAbstractScrollArea):
+    # Shows all pages stacked vertically. Only the pages that intersect the
+    # viewport plus a margin get a QGraphicsView; pages that scroll out of
+    # the margin are released so that their scene and text layout can be
+    # freed.
+
+    zoomChanged = QtCore.pyqtSignal()
+    pageChanged = QtCore.pyqtSignal()
+    pageActivated = QtCore.pyqtSignal(QtCore.QObject)
+    currentPage = None
+
+    spacing = 10
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.zoom = 1
+        self.pages = []
+        self._tops = []
+        self._bottoms = []
+        self._widths = []
+        self._width = 0
+        self._views = {}
+        self._spare = []
+        self.viewport().setBackgroundRole(QtGui.QPalette.Dark)
+        self.viewport().setAutoFillBackground(True)
+        self.verticalScrollBar().setSingleStep(20)
+        self.horizontalScrollBar().setSingleStep(20)
+
+    def setPages(self, pages):
+        for number in list(self._views):
+            self._releaseView(number)
+        self.pages = pages
+        self.currentPage = None
+        self._tops = []
+        self._bottoms = []
+        self._widths = []
+        y = 0
+        for page in pages:
+            rect = page_rect(page.project.document.page(page.number))
+            self._tops.append(y)
+            self._bottoms.append(y + rect.height())
+            self._widths.append(rect.width())
+            y += rect.height() + self.spacing
+        self._width = max(self._widths, default=0)
+        self.verticalScrollBar().setValue(0)
+        self._updateGeometry()
+
+    def setZoom(self, zoom):
+        center = self._centerPoint()
+        self.zoom = zoom
+        self.updateTransform(center)
+
+    def updateTransform(self, center=0):
+        self._updateGeometry()
+        self.verticalScrollBar().setValue(
+            int(center * self.zoom - self.viewport().height() / 2)
+        )
+        self.zoomChanged.emit()
+
+    def zoomReset(self):
+        self.setZoom(1)
+
+    def zoomIn(self):
+        self.setZoom(self.zoom * 1.5)
+
+    def zoomOut(self):
+        self.setZoom(self.zoom / 1.5)
+
+    def wheelEvent(self, event):
+        if event.modifiers() == QtCore.Qt.ControlModifier:
+            pixel_delta = event.pixelDelta()
+            if pixel_delta.x() != 0 or pixel_delta.y() != 0:
+                self.setZoom(self.zoom * 2.0 ** (pixel_delta.y() / 300.0))
+            else:
+                self.setZoom(self.zoom * 2.0 ** (event.angleDelta().y() / 300.0))
+        else:
+            super().wheelEvent(event)
+
+    def currentPageChanged(self, page):
+        if page is self.currentPage:
+            return
+        self.currentPage = page
+        if page is not None and page.number < len(self._tops):
+            self.verticalScrollBar().setValue(int(self._tops[page.number] * self.zoom))
+        self.pageChanged.emit()
+
+    def pageAt(self, globalPos):
+        # The page under a point on the screen and the point in its scene,
+        # or None and None if it is not on a page.
+        pos = self.viewport().mapFromGlobal(globalPos)
+        for number, view in self._views.items():
+            if view.geometry().contains(pos):
+                return (
+                    self.pages[number],
+                    view.mapToScene(view.mapFromGlobal(globalPos)),
+                )
+        return None, None
+
+    def focusPage(self):
+        # The page that keyboard actions apply to: the one whose view has
+        # the focus, that is, the last one clicked.
+        for number, view in self._views.items():
+            if view.hasFocus():
+                return self.pages[number]
+        return self.currentPage
+
+    def _centerPoint(self):
+        # The document y coordinate (in points) in the middle of the viewport.
+        if not self._tops:
+            return 0
+        v = self.verticalScrollBar().value() + self.viewport().height() / 2
+        return v / self.zoom
+
+    def _updateGeometry(self):
+        viewport = self.viewport().size()
+        height = (self._bottoms[-1] if self._bottoms else 0) * self.zoom
+        width = self._width * self.zoom
+        vbar = self.verticalScrollBar()
+        vbar.setRange(0, max(0, int(height - viewport.height())))
+        vbar.setPageStep(viewport.height())
+        hbar = self.horizontalScrollBar()
+        hbar.setRange(0, max(0, int(width - viewport.width())))
+        hbar.setPageStep(viewport.width())
+        self._layoutPages()
+
+    def _visiblePages(self):
+        margin = self.viewport().height() / self.zoom
+        top = self.verticalScrollBar().value() / self.zoom - margin
+        bottom = top + 3 * margin
+        first = bisect.bisect_right(self._bottoms, top)
+        last = bisect.bisect_left(self._tops, bottom)
+        return range(first, last)
+
+    def _layoutPages(self):
+        if not self.isVisible():
+            return
+        visible = self._visiblePages()
+        for number in list(self._views):
+            if number not in visible:
+                self._releaseView(number)
+        viewport = self.viewport().size()
+        dx = -self.horizontalScrollBar().value()
+        if self._width * self.zoom < viewport.width():
+            dx = (viewport.width() - self._width * self.zoom) / 2
+        dy = -self.verticalScrollBar().value()
+        for number in visible:
+            view = self._views.get(number)
+            if view is None:
+                view = self._createView(self.pages[number])
+                self._views[number] = view
+            view.setTransform(QtGui.QTransform.fromScale(self.zoom, self.zoom))
+            x = (self._width - self._widths[number]) / 2
+            view.setGeometry(
+                int(dx + x * self.zoom),
+                int(dy + self._tops[number] * self.zoom),
+                int(self._widths[number] * self.zoom) + 1,
+                int((self._bottoms[number] - self._tops[number]) * self.zoom) + 1,
+            )
+        self._updateCurrentPage()
+
+    def _createView(self, page):
+        if self._spare:
+            view = self._spare.pop()
+        else:
+            view = QtWidgets.QGraphicsView(self.viewport())
+            view.setFrameShape(QtWidgets.QFrame.NoFrame)
+            view.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+            view.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
+            view.setAlignment(QtCore.Qt.AlignLeft | QtCore.Qt.AlignTop)
+        view.setScene(page.scene)
+        view.setSceneRect(page.pageItem.boundingRect())
+        view.show()
+        return view
+
+    def _releaseView(self, number):
+        view = self._views.pop(number)
+        view.hide()
+        view.setScene(None)
+        self._spare.append(view)
+        page = self.pages[number]
+        if page is not self.currentPage:
+            page.release()
+
+    def _updateCurrentPage(self):
+        if not self.pages:
+            return
+        number = bisect.bisect_left(self._bottoms, self._centerPoint())
+        page = self.pages[min(number, len(self.pages) - 1)]
+        if page is not self.currentPage:
+            previous = self.currentPage
+            self.currentPage = page
+            if previous is not None and previous.number not in self._views:
+                previous.release()
+            self.pageActivated.emit(page)
+
+    def scrollContentsBy(self, dx, dy):
+        self._layoutPages()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._updateGeometry()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self._layoutPages()
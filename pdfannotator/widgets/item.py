@@ -1,4 +1,9 @@
 from PyQt5 import QtGui, QtCore, QtWidgets
+from ..commands import GEOMETRY
+
+# Milliseconds between applying the geometry of an item that is being
+# dragged or resized, so that fast mice move it at most once per frame.
+FRAME_INTERVAL = 16
 
 
 class GeometryCommand(QtWidgets.QUndoCommand):
@@ -14,6 +19,16 @@ class GeometryCommand(QtWidgets.QUndoCommand):
     def redo(self):
         self.item.changeRect(self.t)
 
+    def id(self):
+        return GEOMETRY
+
+    def mergeWith(self, other):
+        # Consecutive moves and resizes of one item are a single step.
+        if other.item is not self.item:
+            return False
+        self.t = other.t
+        return True
+
 
 class ItemBase(QtWidgets.QGraphicsItem):
     def __init__(self, page):
@@ -27,6 +42,8 @@ class ItemBase(QtWidgets.QGraphicsItem):
         self.resizeLeft = False
         self.resizeRight = False
         self.moveStart = None
+        self.pendingRect = None
+        self.hoverCursor = None
         self.setFlag(self.ItemIsMovable, True)
         self.setFlag(self.ItemIsSelectable, True)
         self.properties = ["width", "height", "top", "left"]
@@ -41,7 +58,15 @@ class ItemBase(QtWidgets.QGraphicsItem):
 
     def changeRect(self, r):
         self.prepareGeometryChange()
-        self.innerRect = r
+        # A copy, since r may belong to an undo command.
+        self.innerRect = QtCore.QRectF(r)
+
+    def applyPendingRect(self):
+        if self.pendingRect is not None:
+            r = self.pendingRect
+            self.pendingRect = None
+            if r != self.innerRect:
+                self.changeRect(r)
 
     def paint(self, painter, option, widget):
         if self.isHovering or self.isSelected():
@@ -105,34 +130,43 @@ class ItemBase(QtWidgets.QGraphicsItem):
 
     def mouseMoveEvent(self, event):
         if self.myEvent:
+            # Only record the new rect here; it is applied by a timer, so
+            # the scene reindexes and repaints the item once per frame
+            # however many move events arrive.
             p = event.pos()
-            self.prepareGeometryChange()
+            r = QtCore.QRectF(self.startRect)
             if self.resizeTop:
-                self.innerRect.setTop(p.y())
+                r.setTop(p.y())
             if self.resizeBottom:
-                self.innerRect.setBottom(p.y())
+                r.setBottom(p.y())
             if self.resizeLeft:
-                self.innerRect.setLeft(p.x())
+                r.setLeft(p.x())
             if self.resizeRight:
-                self.innerRect.setRight(p.x())
+                r.setRight(p.x())
             self.commandName = "Resize item"
             if self.moveStart:
-                self.innerRect.moveTo(
+                r.moveTo(
                     self.moveStart[0].x() + p.x() - self.moveStart[1].x(),
                     self.moveStart[0].y() + p.y() - self.moveStart[1].y(),
                 )
                 self.commandName = "Move item"
+            if self.pendingRect is None:
+                QtCore.QTimer.singleShot(FRAME_INTERVAL, self.applyPendingRect)
+            self.pendingRect = r
         else:
             super().mouseMoveEvent(event)
 
     def mouseReleaseEvent(self, event):
         if self.myEvent:
+            self.applyPendingRect()
             if self.innerRect != self.startRect:
-                GeometryCommand(
-                    self,
-                    self.startRect,
-                    QtCore.QRectF(self.innerRect),
-                    self.commandName,
+                self.page.project.undoStack.push(
+                    GeometryCommand(
+                        self,
+                        self.startRect,
+                        QtCore.QRectF(self.innerRect),
+                        self.commandName,
+                    )
                 )
         else:
             super().mouseReleaseEvent(event)
@@ -145,22 +179,26 @@ class ItemBase(QtWidgets.QGraphicsItem):
         self.isHovering = False
         self.update()
 
-    def hoverMoveEvent(self, event):
-        p = event.pos()
-        if self.onLeft(p) and self.onTop(p):
-            self.setCursor(QtCore.Qt.SizeFDiagCursor)
-        elif self.onRight(p) and self.onBottom(p):
-            self.setCursor(QtCore.Qt.SizeFDiagCursor)
-        elif self.onRight(p) and self.onTop(p):
-            self.setCursor(QtCore.Qt.SizeBDiagCursor)
-        elif self.onLeft(p) and self.onBottom(p):
-            self.setCursor(QtCore.Qt.SizeBDiagCursor)
-        elif self.onLeft(p) or self.onRight(p):
-            self.setCursor(QtCore.Qt.SizeHorCursor)
-        elif self.onTop(p) or self.onBottom(p):
-            self.setCursor(QtCore.Qt.SizeVerCursor)
+    def hoverCursorShape(self, p):
+        left, right = self.onLeft(p), self.onRight(p)
+        top, bottom = self.onTop(p), self.onBottom(p)
+        if (left and top) or (right and bottom):
+            return QtCore.Qt.SizeFDiagCursor
+        elif (right and top) or (left and bottom):
+            return QtCore.Qt.SizeBDiagCursor
+        elif left or right:
+            return QtCore.Qt.SizeHorCursor
+        elif top or bottom:
+            return QtCore.Qt.SizeVerCursor
         else:
-            self.setCursor(QtCore.Qt.OpenHandCursor)
+            return QtCore.Qt.OpenHandCursor
+
+    def hoverMoveEvent(self, event):
+        # Only tell Qt about the cursor when it crosses into another zone.
+        shape = self.hoverCursorShape(event.pos())
+        if shape != self.hoverCursor:
+            self.hoverCursor = shape
+            self.setCursor(shape)
 
 
 class ImageItem(ItemBase):
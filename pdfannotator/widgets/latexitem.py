@@ -0,0 +1,136 @@
+from PyQt5 import QtGui, QtCore, QtWidgets
+from .item import ItemBase
+from ..latex import Box, box_key
+from ..renderer import load_document
+from ..rendercache import quantize_zoom, zoom_for_level
+
+
+class SourceCommand(QtWidgets.QUndoCommand):
+    def __init__(self, item, f, t):
+        super().__init__("Edit LaTeX")
+        self.item = item
+        self.f = f
+        self.t = t
+
+    def undo(self):
+        self.item.setSource(self.f)
+
+    def redo(self):
+        self.item.setSource(self.t)
+
+
+class LatexItem(ItemBase):
+    # A LaTeX formula, drawn from an image of its compiled box. The box is
+    # saved with the item, so loading a project does not run LaTeX, and
+    # the image is only rendered again when the zoom level changes.
+
+    # Number of zoom levels to keep images for.
+    cached_levels = 2
+
+    def __init__(self, page, source=""):
+        ItemBase.__init__(self, page)
+        self.source = ""
+        self.box = None
+        self.error = None
+        self.innerRect = QtCore.QRectF(0, 0, 20, 20)
+        self._document = None
+        self._images = {}
+        if source:
+            self.setSource(source)
+
+    def setSource(self, source):
+        self.source = source
+        self.error = None
+        project = self.page.project
+        if project is not None:
+            # A box still being compiled for the previous source is stale.
+            project.latex.cancel(self._compiled)
+            project.latex.request(source, self._compiled)
+        self.update()
+
+    def _compiled(self, box, error):
+        self.error = error
+        if box is not None:
+            self.setBox(box)
+        else:
+            self.update()
+
+    def setBox(self, box):
+        self.box = box
+        self._document = None
+        self._images = {}
+        self.changeRect(
+            QtCore.QRectF(
+                self.innerRect.topLeft(), QtCore.QSizeF(box.width, box.height)
+            )
+        )
+        self.update()
+
+    def _image(self, level):
+        image = self._images.get(level)
+        if image is None:
+            if self._document is None:
+                self._document = load_document(QtCore.QByteArray(self.box.pdf))
+                self._document.setPaperColor(QtCore.Qt.transparent)
+            dpi = 72 * zoom_for_level(level)
+            image = self._document.page(0).renderToImage(dpi, dpi)
+            if len(self._images) >= self.cached_levels:
+                self._images.pop(next(iter(self._images)))
+            self._images[level] = image
+        return image
+
+    def paint(self, painter, option, widget):
+        if self.box is not None:
+            level = quantize_zoom(
+                option.levelOfDetailFromTransform(painter.worldTransform())
+            )
+            painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, True)
+            painter.drawImage(self.innerRect, self._image(level))
+        else:
+            # Not compiled yet, or the source has an error.
+            color = QtCore.Qt.red if self.error is not None else QtCore.Qt.gray
+            painter.setPen(QtGui.QPen(color, 0, QtCore.Qt.DashLine))
+            painter.setBrush(QtCore.Qt.NoBrush)
+            painter.drawRect(self.innerRect)
+        ItemBase.paint(self, painter, option, widget)
+
+    def mouseDoubleClickEvent(self, event):
+        source, ok = QtWidgets.QInputDialog.getMultiLineText(
+            event.widget(), "Edit LaTeX", "LaTeX source:", self.source
+        )
+        if ok and source != self.source:
+            self.page.project.undoStack.push(SourceCommand(self, self.source, source))
+
+    def getName(self):
+        return "LaTeX"
+
+    def save(self, s, version):
+        s.writeQString(self.source)
+        s << self.innerRect
+        box = self.box or Box(b"", 0, 0, 0)
+        s.writeBytes(box.pdf)
+        s.writeDouble(box.width)
+        s.writeDouble(box.height)
+        s.writeDouble(box.depth)
+
+    def load(self, s, version):
+        self.source = s.readQString()
+        rect = QtCore.QRectF()
+        s >> rect
+        self.innerRect = rect
+        pdf = bytes(s.readBytes())
+        width = s.readDouble()
+        height = s.readDouble()
+        depth = s.readDouble()
+        project = self.page.project
+        if pdf:
+            self.box = Box(pdf, width, height, depth)
+            if project is not None:
+                project.latex.cache.put(box_key(self.source), self.box)
+        elif self.source and project is not None:
+            # Saved before it had compiled.
+            project.latex.request(self.source, self._compiled)
+
+    @staticmethod
+    def id():
+        return 5
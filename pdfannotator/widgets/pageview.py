@@ -1,4 +1,5 @@
 from PyQt5 import QtGui, QtWidgets, QtCore
+from ..rendercache import quantize_zoom
 
 
 class PageView(QtWidgets.QGraphicsView):
@@ -10,12 +11,24 @@ class PageView(QtWidgets.QGraphicsView):
         super().__init__(parent)
         self.zoom = 1
 
+    def setZoom(self, zoom):
+        self.zoom = zoom
+        self.updateTransform()
+
     def updateTransform(self):
         t = QtGui.QTransform()
         t.scale(self.zoom, self.zoom)
         self.setTransform(t)
         self.zoomChanged.emit()
 
+    def pageAt(self, globalPos):
+        # The page under a point on the screen and the point in its scene.
+        return self.currentPage, self.mapToScene(self.mapFromGlobal(globalPos))
+
+    def focusPage(self):
+        # The page that keyboard actions apply to.
+        return self.currentPage
+
     def zoomReset(self):
         self.zoom = 1
         self.updateTransform()
@@ -41,5 +54,14 @@ class PageView(QtWidgets.QGraphicsView):
 
     def currentPageChanged(self, page):
         self.currentPage = page
+        if self.isHidden():
+            # The continuous view is showing the pages, and setContinuous
+            # brings this view up to date when it comes back.
+            return
         self.setScene(page.scene if page else None)
+        if page:
+            visible = self.mapToScene(self.viewport().rect()).boundingRect()
+            page.project.prefetcher.pageChanged(
+                page.number, quantize_zoom(self.zoom), visible
+            )
         self.pageChanged.emit()
@@ -1,11 +1,21 @@
 import re
 import math
+import bisect
 import collections
+import numpy as np
 from PyQt5 import QtCore, QtWidgets, QtGui
+from ..rendercache import (
+    TILE_SIZE,
+    quantize_zoom,
+    zoom_for_level,
+    tile_range,
+    tile_rect,
+)
 
 
 class PdfPageItem(QtWidgets.QGraphicsItem):
     _lines = None
+    _margins = None
     _selected = None
     _selected_rects = None
     _prev_v_pos = None
@@ -14,16 +24,16 @@ class PdfPageItem(QtWidgets.QGraphicsItem):
 
     selection_brush = QtGui.QColor("#4a90d9")
 
-    def __init__(self, poppler_page, event_handler):
+    _level = None
+
+    def __init__(self, poppler_page, event_handler, renderer):
         assert poppler_page is not None
         super().__init__()
         self.setFlag(self.ItemIsFocusable, True)
         self._event_handler = event_handler
-        self.image = None
-        self.cachedRect = None
+        self._renderer = renderer
         self.poppler_page = poppler_page
-        tmp = self.poppler_page.renderToImage(72, 72)
-        self.rect = QtCore.QRectF(0, 0, tmp.width(), tmp.height())
+        self.rect = page_rect(poppler_page)
         self.setFlag(self.ItemUsesExtendedStyleOption, True)
         # for bbox, line in self.lines():
         #     print(bbox, [word.text() for word in line])
@@ -38,8 +48,11 @@ class PdfPageItem(QtWidgets.QGraphicsItem):
                 else:
                     adjustment = QtCore.QPointF(0, 0)
                 self._prev_v_pos = v_pos
+                undoStack = self._event_handler.project.undoStack
+                undoStack.beginMacro("Insert V")
                 self._prev_v = self._event_handler.insertV(v_pos + adjustment)
                 self._event_handler.insertText(self.get_margin_point(space.bbox.top()))
+                undoStack.endMacro()
                 self._set_selected(None)
                 return
         if event.key() == ord("-"):
@@ -52,6 +65,8 @@ class PdfPageItem(QtWidgets.QGraphicsItem):
                     adjustment = self._prev_strikethrough.y()
                 else:
                     adjustment = 0
+                undoStack = self._event_handler.project.undoStack
+                undoStack.beginMacro("Strike through")
                 for line in lines:
                     self._prev_strikethrough = self._event_handler.insertStrikethrough(
                         line
@@ -59,29 +74,19 @@ class PdfPageItem(QtWidgets.QGraphicsItem):
                     # Copy the y-movement but not the x
                     self._prev_strikethrough.setPos(0, adjustment)
                 self._event_handler.insertText(self.get_margin_point(lines[0].top()))
+                undoStack.endMacro()
                 self._set_selected(None)
                 return
         super().keyPressEvent(event)
 
     def get_margin_point(self, top):
-        lines = self.lines()
-
-        widths = [line.bbox.width() for line in lines]
-        median_width = sorted(widths)[len(widths) // 2]
-        lines = [line for line in lines if line.bbox.width() >= median_width]
-
-        right_margin = self.rect.right()
-        lefts = []
-        rights = []
-        for line in lines:
-            lefts.append(line.bbox.left())
-            rights.append(right_margin - line.bbox.right())
-        left = sorted(lefts)[int(len(lefts) * .2)]
-        right = sorted(rights)[int(len(rights) * .2)]
+        if self._margins is None:
+            self._margins = margin_offsets(self.lines().line_boxes, self.rect.right())
+        left, right = self._margins
         if left > right:
             return QtCore.QPointF(8, top)
         else:
-            return QtCore.QPointF(right_margin - right + 8, top)
+            return QtCore.QPointF(self.rect.right() - right + 8, top)
 
     def selected_space(self):
         if not self._selected or self._selected[0] != self._selected[1]:
@@ -93,43 +98,76 @@ class PdfPageItem(QtWidgets.QGraphicsItem):
     def lines(self):
         if self._lines is not None:
             return self._lines
-        self._lines = partition_into_lines(self.poppler_page.textList())
+        self._lines = self._event_handler.text_layout()
         return self._lines
 
     def boundingRect(self):
         return self.rect
 
     def paint(self, painter, option, widget):
-        d = option.levelOfDetailFromTransform(painter.worldTransform())
-        d = min(d, 8)
-        r = self.boundingRect()
-        top = math.floor(r.top() * d)
-        left = math.floor(r.left() * d)
-        bottom = math.ceil(r.bottom() * d)
-        right = math.ceil(r.right() * d)
-
-        if (top, left, right, bottom) != self.cachedRect:
-            self.image = self.poppler_page.renderToImage(
-                72 * d, 72 * d, left, top, right - left, bottom - top
-            )
-            self.cachedRect = (top, left, right, bottom)
-        painter.drawImage(
-            QtCore.QRectF(left / d, top / d, (right - left) / d, (bottom - top) / d),
-            self.image,
+        level = quantize_zoom(
+            option.levelOfDetailFromTransform(painter.worldTransform())
         )
+        number = self._event_handler.number
+        if level != self._level:
+            # Renders for the zoom level we are leaving are no longer needed.
+            self._level = level
+            self._renderer.cancel(lambda key: key[0] == number and key[1] != level)
+        d = zoom_for_level(level)
+        cache = self._renderer.cache
+        exposed = option.exposedRect.intersected(self.rect)
+        for tx, ty in tile_range(exposed, d):
+            tile = tile_rect(self.rect.width(), self.rect.height(), level, tx, ty)
+            if tile is None:
+                continue
+            x, y, w, h = tile
+            target = QtCore.QRectF(x / d, y / d, w / d, h / d)
+            key = (number, level, tx, ty)
+            image = cache.get(key)
+            if image is None:
+                self._renderer.request(key, tile, self.update)
+                self._draw_fallback(painter, level, target)
+            else:
+                painter.drawImage(target, image)
         painter.save()
         painter.setCompositionMode(QtGui.QPainter.CompositionMode_Multiply)
         for rect in self.get_selected_rects():
             painter.fillRect(rect, self.selection_brush)
         painter.restore()
 
+    def _draw_fallback(self, painter, level, target):
+        # Draw the tiles of the nearest zoom level that covers target
+        # entirely, preferring lower resolutions, or a blank page.
+        number = self._event_handler.number
+        cache = self._renderer.cache
+        levels = list(range(level - 1, level - 7, -1)) + [level + 1, level + 2]
+        for other in levels:
+            d = zoom_for_level(other)
+            tiles = []
+            for tx, ty in tile_range(target, d):
+                image = cache.get((number, other, tx, ty))
+                if image is None:
+                    break
+                tiles.append((tx, ty, image))
+            else:
+                painter.save()
+                painter.setClipRect(target, QtCore.Qt.IntersectClip)
+                for tx, ty, image in tiles:
+                    painter.drawImage(
+                        QtCore.QRectF(
+                            tx * TILE_SIZE / d,
+                            ty * TILE_SIZE / d,
+                            image.width() / d,
+                            image.height() / d,
+                        ),
+                        image,
+                    )
+                painter.restore()
+                return
+        painter.fillRect(target, QtCore.Qt.white)
+
     def find_word(self, pos):
-        for i, (bbox, line) in enumerate(self.lines()):
-            if not bbox.contains(pos):
-                continue
-            for j, word in enumerate(line):
-                if word.bbox.contains(pos):
-                    return i, j
+        return self.lines().find(pos)
 
     def mousePressEvent(self, event):
         if event.button() == QtCore.Qt.LeftButton:
@@ -163,7 +201,7 @@ class PdfPageItem(QtWidgets.QGraphicsItem):
     def get_selected_word(self):
         if self._selected:
             line, word = self._selected[0]
-            return self.lines()[line].words[word]
+            return self.lines().word(line, word)
 
     def get_selected_rects(self):
         if self._selected_rects is not None:
@@ -174,15 +212,12 @@ class PdfPageItem(QtWidgets.QGraphicsItem):
         start_line, start_word = min(self._selected)
         end_line, end_word = max(self._selected)
         self._selected_rects = []
+        lines = self.lines()
         for i in range(start_line, end_line + 1):
-            words = self.lines()[i].words
-            if i == end_line:
-                words = words[: end_word + 1]
-            if i == start_line:
-                words = words[start_word:]
-            if words:
-                bboxes = [word.bbox for word in words]
-                self._selected_rects.append(smallest_enclosing_rectf(bboxes))
+            start = start_word if i == start_line else 0
+            end = end_word + 1 if i == end_line else lines.line_length(i)
+            if start < end:
+                self._selected_rects.append(lines.words_rectf(i, start, end))
         return self._selected_rects
 
     def focusOutEvent(self, event):
@@ -190,23 +225,133 @@ class PdfPageItem(QtWidgets.QGraphicsItem):
         self._set_selected(None)
 
 
-def smallest_enclosing_rectf(bboxes):
-    top = bboxes[0].top()
-    left = bboxes[0].left()
-    right = bboxes[0].right()
-    bottom = bboxes[0].bottom()
-    for bbox in bboxes:
-        top = min(top, bbox.top())
-        left = min(left, bbox.left())
-        right = max(right, bbox.right())
-        bottom = max(bottom, bbox.bottom())
+def page_rect(poppler_page):
+    # pageSizeF is in points, which is the scene unit (72 dpi).
+    size = poppler_page.pageSizeF()
+    return QtCore.QRectF(0, 0, math.ceil(size.width()), math.ceil(size.height()))
+
+
+# Layout analysis works on (n, 4) arrays of left, top, right, bottom.
+
+
+def boxes_array(bboxes):
+    return np.array(
+        [(b.left(), b.top(), b.right(), b.bottom()) for b in bboxes], dtype=float
+    ).reshape(-1, 4)
+
+
+def box_rectf(box):
+    left, top, right, bottom = box
     return QtCore.QRectF(left, top, right - left, bottom - top)
 
 
-Line = collections.namedtuple("Line", "bbox words")
+def enclosing_box(boxes):
+    return np.concatenate((boxes[:, :2].min(axis=0), boxes[:, 2:].max(axis=0)))
+
+
+def kth_smallest(values, k):
+    return np.partition(values, k)[k]
+
+
+def margin_offsets(line_boxes, right_margin):
+    # The left margin and the distance from the right margin of the lines
+    # at least as wide as the median line, both at the 20th percentile.
+    if len(line_boxes) == 0:
+        return 0, 0
+    widths = line_boxes[:, 2] - line_boxes[:, 0]
+    median_width = kth_smallest(widths, len(widths) // 2)
+    wide = line_boxes[widths >= median_width]
+    k = int(len(wide) * 0.2)
+    left = kth_smallest(wide[:, 0], k)
+    right = kth_smallest(right_margin - wide[:, 2], k)
+    return float(left), float(right)
+
+
 Word = collections.namedtuple("Word", "bbox text")
 
 
+class PageText:
+    # The text layout of a page as flat arrays. Row k of word_boxes is the
+    # box of word k, its text is text[text_offsets[k]:text_offsets[k + 1]],
+    # and line i holds words line_starts[i] up to line_starts[i + 1].
+    # Lines are sorted by their top edge. Spaces between the words of a
+    # line are words with empty text.
+
+    def __init__(self, word_boxes, text, text_offsets, line_starts):
+        self.word_boxes = np.asarray(word_boxes, dtype=np.float32).reshape(-1, 4)
+        self.text = text
+        self.text_offsets = np.asarray(text_offsets, dtype=np.int32)
+        self.line_starts = np.asarray(line_starts, dtype=np.int32)
+        starts = self.line_starts[:-1]
+        if len(starts):
+            self.line_boxes = np.concatenate(
+                (
+                    np.minimum.reduceat(self.word_boxes[:, :2], starts),
+                    np.maximum.reduceat(self.word_boxes[:, 2:], starts),
+                ),
+                axis=1,
+            )
+        else:
+            self.line_boxes = np.zeros((0, 4), dtype=np.float32)
+        self._max_height = float(
+            (self.line_boxes[:, 3] - self.line_boxes[:, 1]).max(initial=0)
+        )
+        # Overlapping words can leave the lefts of a line unsorted;
+        # such lines are scanned linearly in find().
+        self._sorted = [
+            bool(np.all(np.diff(self.word_boxes[a:b, 0]) >= 0))
+            for a, b in zip(self.line_starts[:-1], self.line_starts[1:])
+        ]
+
+    def __len__(self):
+        return len(self.line_starts) - 1
+
+    def line_length(self, i):
+        return int(self.line_starts[i + 1] - self.line_starts[i])
+
+    def line_bbox(self, i):
+        return box_rectf(self.line_boxes[i])
+
+    def word(self, i, j):
+        k = self.line_starts[i] + j
+        text = self.text[self.text_offsets[k] : self.text_offsets[k + 1]]
+        return Word(box_rectf(self.word_boxes[k]), text)
+
+    def words_rectf(self, i, start, end):
+        first = self.line_starts[i]
+        return box_rectf(enclosing_box(self.word_boxes[first + start : first + end]))
+
+    def find(self, pos):
+        # Return (line, word) indices of the first word containing pos.
+        # Lines are bisected on their top edge, words on their left edge.
+        x, y = pos.x(), pos.y()
+        tops = self.line_boxes[:, 1]
+        lo = np.searchsorted(tops, y - self._max_height, "left")
+        hi = np.searchsorted(tops, y, "right")
+        for i in range(lo, hi):
+            left, top, right, bottom = self.line_boxes[i]
+            if not (left <= x <= right and top <= y <= bottom):
+                continue
+            boxes = self.word_boxes[self.line_starts[i] : self.line_starts[i + 1]]
+            if self._sorted[i]:
+                j = int(np.searchsorted(boxes[:, 0], x, "right")) - 1
+                if j < 0 or not _contains(boxes[j], x, y):
+                    continue
+                # Words sharing the edge at x contain pos as well.
+                while j > 0 and _contains(boxes[j - 1], x, y):
+                    j -= 1
+                return int(i), j
+            for j in range(len(boxes)):
+                if _contains(boxes[j], x, y):
+                    return int(i), j
+
+
+def _contains(box, x, y):
+    # Like QRectF.contains, which also accepts boxes of negative width.
+    left, top, right, bottom = box
+    return min(left, right) <= x <= max(left, right) and top <= y <= bottom
+
+
 def partition_into_lines(textbox):
     in_degree = {word: 0 for word in textbox}
     for word in textbox:
@@ -217,34 +362,52 @@ def partition_into_lines(textbox):
         if in_degree[word] == 1:
             continue
         line = []
-        bboxes = []
         last_end = None
         while len(line) < len(textbox):
             bbox = word.boundingBox()
             if last_end is not None:
-                space_bbox = QtCore.QRectF(
-                    last_end, bbox.top(), bbox.left() - last_end, bbox.height()
-                )
-                line.append(Word(space_bbox, ""))
+                space_box = (last_end, bbox.top(), bbox.left(), bbox.bottom())
+                line.append((space_box, ""))
             last_end = bbox.right()
             text = word.text()
             bounds = split_word(text)
-            if len(bounds) == 1:
-                line.append(Word(bbox, text))
-                bboxes.append(bbox)
+            if len(bounds) <= 1:
+                box = (bbox.left(), bbox.top(), bbox.right(), bbox.bottom())
+                line.append((box, text))
             else:
-                char_bbox = [word.charBoundingBox(i) for i in range(len(text))]
-                for i, j in bounds:
-                    sub_bbox = smallest_enclosing_rectf(char_bbox[i:j])
-                    line.append(Word(sub_bbox, text[i:j]))
-                    bboxes.append(sub_bbox)
+                # The parts of a word cover all of its characters in order,
+                # so the part boxes are reductions over consecutive runs.
+                char_boxes = boxes_array(
+                    [word.charBoundingBox(i) for i in range(len(text))]
+                )
+                starts = [i for i, j in bounds]
+                part_boxes = np.concatenate(
+                    (
+                        np.minimum.reduceat(char_boxes[:, :2], starts),
+                        np.maximum.reduceat(char_boxes[:, 2:], starts),
+                    ),
+                    axis=1,
+                )
+                for (i, j), part_box in zip(bounds, part_boxes.tolist()):
+                    line.append((part_box, text[i:j]))
             word = word.nextWord()
             if not word or in_degree[word] != 1:
                 break
-        bbox = smallest_enclosing_rectf(bboxes)
-        lines.append(Line(bbox, line))
-    lines.sort(key=lambda line: line[0].top())
-    return lines
+        lines.append(line)
+    # The top of a line is the top of its highest word.
+    lines.sort(key=lambda line: min(box[1] for box, text in line))
+
+    word_boxes = []
+    texts = []
+    text_offsets = [0]
+    line_starts = [0]
+    for line in lines:
+        for box, text in line:
+            word_boxes.append(box)
+            texts.append(text)
+            text_offsets.append(text_offsets[-1] + len(text))
+        line_starts.append(len(word_boxes))
+    return PageText(word_boxes, "".join(texts), text_offsets, line_starts)
 
 
 def split_word(word):
@@ -1,4 +1,5 @@
 from PyQt5 import QtGui, QtCore, QtWidgets
+from ..commands import TextEditCommand
 
 
 class TextItem(QtWidgets.QGraphicsTextItem):
@@ -17,6 +18,7 @@ class TextItem(QtWidgets.QGraphicsTextItem):
         self.setPlainText("Hello")
         if font:
             self.setFont(font)
+        document.undoCommandAdded.connect(self._documentEdited)
         # self.setTextInteractionFlags(QtCore.Qt.TextEditorInteraction)
 
     def save(self, s, version):
@@ -33,6 +35,26 @@ class TextItem(QtWidgets.QGraphicsTextItem):
     def getName(self):
         return "Text"
 
+    def _undoStack(self):
+        project = getattr(self.page, "project", None)
+        return project.undoStack if project is not None else None
+
+    def _documentEdited(self):
+        # Put each edit on the project's undo stack, so that it is undone
+        # in order with the other changes to the page.
+        undoStack = self._undoStack()
+        if undoStack is not None:
+            undoStack.push(TextEditCommand(self.document()))
+
+    def keyPressEvent(self, event):
+        undoStack = self._undoStack()
+        if undoStack is not None and event.matches(QtGui.QKeySequence.Undo):
+            undoStack.undo()
+        elif undoStack is not None and event.matches(QtGui.QKeySequence.Redo):
+            undoStack.redo()
+        else:
+            super().keyPressEvent(event)
+
     @staticmethod
     def id():
         return 3